@@ -0,0 +1,98 @@
+# Copyright (c) 2025 Benoît Pelletier
+# SPDX-License-Identifier: MPL-2.0
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+import asyncio
+import operator
+from typing import Awaitable, Callable, Generic, Hashable, TypeVar
+from dismob import log
+
+K = TypeVar('K', bound=Hashable)
+V = TypeVar('V')
+
+class WriteBatcher(Generic[K, V]):
+    """
+    Coalesce writes in memory and hand them over in batches.
+    Values added for the same key are merged with `merge` (summed by default), the batch is flushed
+    `interval` seconds after the first pending write or as soon as `max_size` keys are pending.
+    `close` flushes what is left, call it in `cog_unload`.
+    A batch that fails to flush is merged back into the pending writes to be retried with the next one.
+
+    Example:
+        batcher = WriteBatcher(self.write_exp)
+        batcher.add((guild_id, user_id), 35)
+    """
+
+    def __init__(self, flush: Callable[[dict[K, V]], Awaitable[None]], interval: float = 5.0, max_size: int = 100, merge: Callable[[V, V], V] = operator.add):
+        self.interval = interval
+        self.max_size = max_size
+        self.flushed: int = 0
+        self._flush = flush
+        self._merge = merge
+        self._pending: dict[K, V] = {}
+        self._lock = asyncio.Lock()
+        self._timer: asyncio.TimerHandle | None = None
+        self._flush_task: asyncio.Task | None = None
+        self._flush_again: bool = False
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def add(self, key: K, value: V) -> None:
+        if key in self._pending:
+            self._pending[key] = self._merge(self._pending[key], value)
+        else:
+            self._pending[key] = value
+        if len(self._pending) >= self.max_size:
+            self._flush_soon()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.interval, self._flush_soon)
+
+    def _flush_soon(self) -> None:
+        self._cancel_timer()
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_in_background(), name="batcher:flush")
+        else:
+            # The running flush took its batch already, it has to go again for what is pending now
+            self._flush_again = True
+
+    async def _flush_in_background(self) -> None:
+        self._flush_again = True
+        while self._flush_again:
+            self._flush_again = False
+            await self.flush()
+
+    def _cancel_timer(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    async def flush(self) -> None:
+        """Hand over all pending writes right away"""
+        async with self._lock:
+            self._cancel_timer()
+            if not self._pending:
+                return
+            batch, self._pending = self._pending, {}
+            try:
+                await self._flush(batch)
+                self.flushed += len(batch)
+            except Exception as e:
+                log.error(f"Failed to flush {len(batch)} batched writes, they will be retried: {e}", stacktrace=False)
+                newer, self._pending = self._pending, batch
+                for key, value in newer.items():
+                    self._pending[key] = self._merge(batch[key], value) if key in batch else value
+                # Retry after the interval, even if the batch is full, instead of failing in a loop
+                if self._timer is None:
+                    self._timer = asyncio.get_running_loop().call_later(self.interval, self._flush_soon)
+
+    async def close(self) -> None:
+        """Flush what is pending, the batcher should not be used afterwards"""
+        if self._flush_task is not None and not self._flush_task.done():
+            await self._flush_task
+        await self.flush()
+        self._cancel_timer()
+        if self._pending:
+            log.error(f"{len(self._pending)} batched writes lost on close", stacktrace=False)
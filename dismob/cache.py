@@ -0,0 +1,98 @@
+# Copyright (c) 2025 Benoît Pelletier
+# SPDX-License-Identifier: MPL-2.0
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Hashable
+
+class GuildSettingsCache:
+    """
+    Read-through LRU cache of per-guild settings, bounded in size, with entries expiring after a TTL.
+    Plugins wrap their database lookups with `get` and `set` or `invalidate` the guild when they write.
+    Concurrent misses on the same guild share a single load.
+
+    Example:
+        value = await cache.get(guild_id, self.load_greeting_xp)
+    """
+
+    def __init__(self, max_size: int = 1000, ttl: float = 300.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits: int = 0
+        self.misses: int = 0
+        self._entries: OrderedDict[Hashable, tuple[Any, float]] = OrderedDict()
+        self._loading: dict[Hashable, asyncio.Future] = {}
+
+    async def get(self, guild_id: Hashable, loader: Callable[[Hashable], Awaitable[Any]]) -> Any:
+        """Get the cached setting of the guild, or load it with `loader(guild_id)` and cache it"""
+        entry = self._entries.get(guild_id)
+        if entry is not None and entry[1] > time.monotonic():
+            self.hits += 1
+            self._entries.move_to_end(guild_id)
+            return entry[0]
+        self.misses += 1
+
+        while (pending := self._loading.get(guild_id)) is not None:
+            try:
+                return await asyncio.shield(pending)
+            except asyncio.CancelledError:
+                # The caller running the load was cancelled, not this one: load it again
+                if not pending.cancelled():
+                    raise
+        pending = self._loading[guild_id] = asyncio.get_running_loop().create_future()
+        try:
+            value = await loader(guild_id)
+        except Exception as e:
+            if self._loading.get(guild_id) is pending:
+                del self._loading[guild_id]
+            pending.set_exception(e)
+            # Nobody may wait for it, don't warn about an unretrieved exception
+            pending.exception()
+            raise
+        except BaseException:
+            # Cancelled or interrupted, which is not a failure of the load for the other callers
+            if self._loading.get(guild_id) is pending:
+                del self._loading[guild_id]
+            pending.cancel()
+            raise
+        # Invalidated while loading, the value may be outdated so it is returned but not cached
+        if self._loading.get(guild_id) is pending:
+            del self._loading[guild_id]
+            self.set(guild_id, value)
+        pending.set_result(value)
+        return value
+
+    def set(self, guild_id: Hashable, value: Any) -> None:
+        self._entries[guild_id] = (value, time.monotonic() + self.ttl)
+        self._entries.move_to_end(guild_id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, guild_id: Hashable) -> None:
+        self._entries.pop(guild_id, None)
+        self._loading.pop(guild_id, None)
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._loading.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            'size': len(self._entries),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hit_rate
+        }
@@ -0,0 +1,142 @@
+# Copyright (c) 2025 Benoît Pelletier
+# SPDX-License-Identifier: MPL-2.0
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+import asyncio
+import os
+from contextlib import asynccontextmanager
+from typing import Any, Iterable
+import aiosqlite
+from dismob import log
+
+class Database:
+    """
+    Long lived aiosqlite connection to a database file, shared by every plugin opening the same file.
+    The connection is opened on first use in WAL mode, so other processes can read the file while it is written,
+    and keeps up to `cached_statements` prepared statements around for reuse.
+    Use `open_database` to get one and `close` it once done, the connection is closed with its last user.
+    """
+    def __init__(self, path: str, cached_statements: int = 128):
+        self.path = path
+        self.cached_statements = cached_statements
+        self.users: int = 0
+        self._connection: aiosqlite.Connection | None = None
+        self._connect_lock = asyncio.Lock()
+        self._transaction_lock = asyncio.Lock()
+        self._transaction_owner: asyncio.Task | None = None
+
+    @property
+    def is_connected(self) -> bool:
+        return self._connection is not None
+
+    async def connection(self) -> aiosqlite.Connection:
+        if self._connection is not None:
+            return self._connection
+        async with self._connect_lock:
+            if self._connection is None:
+                directory = os.path.dirname(self.path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                connection = await aiosqlite.connect(self.path, cached_statements=self.cached_statements)
+                await connection.execute("PRAGMA journal_mode=WAL")
+                # Safe with WAL, a power loss can only lose the last commits, never corrupt the file
+                await connection.execute("PRAGMA synchronous=NORMAL")
+                self._connection = connection
+                log.info(f"Database `{self.path}` opened")
+        return self._connection
+
+    async def execute(self, sql: str, parameters: Iterable[Any] = ()) -> None:
+        """Execute a statement and commit it, or leave the commit to the current transaction"""
+        async with self._write():
+            await self._connection.execute(sql, parameters)
+
+    async def executemany(self, sql: str, parameters: Iterable[Iterable[Any]]) -> None:
+        """Execute a statement for each set of parameters and commit them, or leave the commit to the current transaction"""
+        async with self._write():
+            await self._connection.executemany(sql, parameters)
+
+    @asynccontextmanager
+    async def _write(self):
+        if self._transaction_owner is not None and self._transaction_owner is asyncio.current_task():
+            yield
+            return
+        # Wait for other tasks transactions, so this write is not committed or rolled back with them
+        async with self._transaction_lock:
+            connection = await self.connection()
+            yield
+            await connection.commit()
+
+    async def fetchone(self, sql: str, parameters: Iterable[Any] = ()) -> aiosqlite.Row | None:
+        async with self._read():
+            async with self._connection.execute(sql, parameters) as cursor:
+                return await cursor.fetchone()
+
+    async def fetchall(self, sql: str, parameters: Iterable[Any] = ()) -> list[aiosqlite.Row]:
+        async with self._read():
+            async with self._connection.execute(sql, parameters) as cursor:
+                return list(await cursor.fetchall())
+
+    @asynccontextmanager
+    async def _read(self):
+        if self._transaction_owner is not None and self._transaction_owner is asyncio.current_task():
+            yield
+            return
+        # The connection is shared, wait for other tasks writes to be committed (or rolled back) instead of reading them
+        async with self._transaction_lock:
+            await self.connection()
+            yield
+
+    @asynccontextmanager
+    async def transaction(self):
+        """
+        Group the writes of the current task in a single commit, rolled back if an exception is raised.
+        Reads and writes from other tasks wait for the transaction to end.
+        """
+        async with self._transaction_lock:
+            connection = await self.connection()
+            self._transaction_owner = asyncio.current_task()
+            try:
+                yield self
+            except BaseException:
+                await connection.rollback()
+                raise
+            else:
+                await connection.commit()
+            finally:
+                self._transaction_owner = None
+
+    async def close(self) -> None:
+        """Release this user of the database, the connection is closed when no one uses it anymore"""
+        self.users = max(0, self.users - 1)
+        if self.users == 0:
+            _databases.pop(self.path, None)
+            await self._close()
+
+    async def _close(self) -> None:
+        if self._connection is not None:
+            connection, self._connection = self._connection, None
+            try:
+                await connection.close()
+                log.info(f"Database `{self.path}` closed")
+            except Exception as e:
+                log.error(f"Failed to close database `{self.path}`: {e}")
+
+_databases: dict[str, Database] = {}
+
+def open_database(path: str, cached_statements: int = 128) -> Database:
+    """Get the shared database for this file, the connection itself is opened on first use"""
+    database = _databases.get(path)
+    if database is None:
+        database = _databases[path] = Database(path, cached_statements)
+    database.users += 1
+    return database
+
+async def close_all() -> None:
+    """Close every opened database, whoever still uses them"""
+    databases = list(_databases.values())
+    _databases.clear()
+    for database in databases:
+        database.users = 0
+        await database._close()
@@ -4,22 +4,40 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at https://mozilla.org/MPL/2.0/.
 
+import asyncio
+import inspect
+import os
+import traceback
 from typing import Any, Callable, List, TypeVar, get_type_hints
 from discord.ext import commands
+from dismob import log
 
 T = TypeVar('T', bound=Callable[..., Any])
 
+# Checking the dispatch arguments against the event signature costs a call per dispatch, only done when debugging
+validate_dispatch: bool = os.getenv('EVENT_DEBUG', '').lower() in ('1', 'true', 'yes')
+
+def _format_exception(exception: BaseException) -> str:
+    return "".join(traceback.format_exception(exception)).rstrip()
+
 class Event:
-    def __init__(self, callback_signature: T) -> None:
+    def __init__(self, callback_signature: T, handler_timeout: float | None = None) -> None:
         """
         Initialize an event system with a specific callback signature.
+        Callbacks can be plain functions or coroutine functions.
         
         Args:
             callback_signature: A function that defines the parameter types callbacks should have
+            handler_timeout: Maximum time in seconds given to each coroutine callback by `dispatch_async`
         """
-        self._handlers: List[T] = []
+        # Replaced instead of modified, so dispatch can iterate it while handlers unregister themselves
+        self._handlers: tuple[T, ...] = ()
+        self._handler_set: set[T] = set()
         self._signature = callback_signature
         self.parameters = get_type_hints(callback_signature)
+        self.handler_timeout = handler_timeout
+        # Coroutines scheduled by `dispatch`, referenced until done so they are not garbage collected
+        self._tasks: set[asyncio.Task] = set()
     
     def register(self, callback: T) -> bool:
         """
@@ -34,14 +52,16 @@ class Event:
         Raises:
             TypeError: If the callback signature doesn't match the event signature
         """
+        if callback in self._handler_set:
+            return False
+
         cb_signature = get_type_hints(callback)
         if cb_signature != self.parameters:
             raise TypeError(f"Callback signature `{cb_signature}` does not match event signature `{self.parameters}`")
         
-        if callback not in self._handlers:
-            self._handlers.append(callback)
-            return True
-        return False
+        self._handler_set.add(callback)
+        self._handlers = self._handlers + (callback,)
+        return True
 
     def unregister(self, callback: T) -> bool:
         """
@@ -53,34 +73,86 @@ class Event:
         Returns:
             bool: True if callback was found and removed, False otherwise
         """
-        if callback in self._handlers:
-            self._handlers.remove(callback)
+        if callback in self._handler_set:
+            self._handler_set.discard(callback)
+            self._handlers = tuple(handler for handler in self._handlers if handler != callback)
             return True
         return False
 
+    def _validate(self, *args: Any, **kwargs: Any) -> None:
+        """Validate arguments against the signature, when `validate_dispatch` is enabled"""
+        if not validate_dispatch:
+            return
+        try:
+            self._signature(*args, **kwargs)
+        except TypeError as e:
+            raise TypeError(f"Invalid arguments for event dispatch: {str(e)}")
+
     def dispatch(self, *args: Any, **kwargs: Any) -> None:
         """
         Dispatch to all registered callbacks.
+        Coroutine callbacks are scheduled as tasks, their exceptions are logged.
         
         Args:
             *args: Positional arguments to pass to the callbacks
             **kwargs: Keyword arguments to pass to the callbacks
             
         Raises:
-            TypeError: If the arguments don't match the callback signature
+            TypeError: If the arguments don't match the callback signature, only checked when `validate_dispatch` is enabled
         """
-        # Validate arguments against signature
-        try:
-            self._signature(*args, **kwargs)
-        except TypeError as e:
-            raise TypeError(f"Invalid arguments for event dispatch: {str(e)}")
+        self._validate(*args, **kwargs)
             
-        for handler in self._handlers[:]:  # Create a copy to allow handlers to unregister themselves
-            handler(*args, **kwargs)
+        for handler in self._handlers:
+            result = handler(*args, **kwargs)
+            if inspect.isawaitable(result):
+                task = asyncio.ensure_future(result)
+                self._tasks.add(task)
+                task.add_done_callback(self._task_done)
+
+    def _task_done(self, task: asyncio.Task) -> None:
+        self._tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            log.error(f"Event handler failed:\n{_format_exception(task.exception())}", stacktrace=False)
+
+    async def dispatch_async(self, *args: Any, **kwargs: Any) -> List[Any]:
+        """
+        Dispatch to all registered callbacks and wait for them.
+        Coroutine callbacks run concurrently, each one limited to `handler_timeout` seconds.
+        A failing callback does not prevent the others from running.
+        
+        Args:
+            *args: Positional arguments to pass to the callbacks
+            **kwargs: Keyword arguments to pass to the callbacks
+            
+        Returns:
+            List[Any]: The result of each callback, in registration order, or the exception it raised
+            
+        Raises:
+            TypeError: If the arguments don't match the callback signature, only checked when `validate_dispatch` is enabled
+        """
+        self._validate(*args, **kwargs)
+
+        async def run(handler: T) -> Any:
+            result = handler(*args, **kwargs)
+            if inspect.isawaitable(result):
+                result = await asyncio.wait_for(result, self.handler_timeout)
+            return result
+
+        handlers = self._handlers
+        results = await asyncio.gather(*(run(handler) for handler in handlers), return_exceptions=True)
+        for handler, result in zip(handlers, results):
+            if isinstance(result, asyncio.TimeoutError):
+                log.error(f"Event handler `{handler.__qualname__}` timed out after {self.handler_timeout}s", stacktrace=False)
+            elif isinstance(result, Exception):
+                log.error(f"Event handler `{handler.__qualname__}` failed:\n{_format_exception(result)}", stacktrace=False)
+            elif isinstance(result, BaseException):
+                raise result
+        return results
     
     def clear(self) -> None:
         """Clear all callbacks."""
-        self._handlers.clear()
+        self._handlers = ()
+        self._handler_set.clear()
 
 
 class BotEvents:
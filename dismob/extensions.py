@@ -0,0 +1,143 @@
+# Copyright (c) 2025 Benoît Pelletier
+# SPDX-License-Identifier: MPL-2.0
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+import ast
+import asyncio
+import importlib.util
+from discord.ext import commands
+from dismob import log, profiling
+
+class ModuleInfo:
+    """
+    What the loader needs to know about a module, read from its source without importing it.
+
+    Attributes:
+        name: The module name, as in `plugins.<name>.main`
+        dependencies: Modules that must be loaded first, from `__dependencies__` and `plugins.*` imports
+        priority: Highest `cog_priority` of the module cogs, higher ones are loaded first
+    """
+    def __init__(self, name: str, dependencies: set[str] = None, priority: int = 0):
+        self.name = name
+        self.dependencies = dependencies or set()
+        self.priority = priority
+
+def _decorator_priority(decorator: ast.expr) -> int | None:
+    """Value of a `@cog_priority(n)` or `@decorators.cog_priority(n)` decorator, if it is one"""
+    if not isinstance(decorator, ast.Call) or not decorator.args:
+        return None
+    func = decorator.func
+    name = func.attr if isinstance(func, ast.Attribute) else getattr(func, "id", None)
+    if name != "cog_priority" or not isinstance(decorator.args[0], ast.Constant):
+        return None
+    return decorator.args[0].value
+
+def read_module_info(name: str, package: str = "plugins") -> ModuleInfo:
+    info = ModuleInfo(name)
+    try:
+        spec = importlib.util.find_spec(f"{package}.{name}.main")
+        with open(spec.origin, "r", encoding="utf-8") as file:
+            tree = ast.parse(file.read(), spec.origin)
+    except Exception as e:
+        # The module will fail to load anyway, let load_extension report why
+        log.warning(f"Could not read module `{name}` metadata: {e}")
+        return info
+
+    priorities = []
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and any(isinstance(target, ast.Name) and target.id == "__dependencies__" for target in node.targets):
+            try:
+                dependencies = ast.literal_eval(node.value)
+                if not isinstance(dependencies, (list, tuple)) or not all(isinstance(dep, str) for dep in dependencies):
+                    raise TypeError("not a list of str")
+                info.dependencies.update(dependencies)
+            except (ValueError, TypeError, SyntaxError):
+                log.warning(f"Module `{name}` has an invalid `__dependencies__`, it must be a literal list of module names")
+        elif isinstance(node, ast.ImportFrom) and node.module and node.module.startswith(f"{package}."):
+            # from plugins.<other>.main import Cog
+            info.dependencies.add(node.module.split(".")[1])
+        elif isinstance(node, ast.ClassDef):
+            priorities.extend(p for p in map(_decorator_priority, node.decorator_list) if p is not None)
+    info.dependencies.discard(name)
+    info.priority = max(priorities, default=0)
+    return info
+
+def plan_waves(infos: list[ModuleInfo], loaded: set[str] = frozenset()) -> tuple[list[list[str]], set[str]]:
+    """
+    Split modules into waves that can be loaded concurrently.
+    A module waits for its dependencies, and among the modules ready to load, only the highest priority ones go.
+
+    Returns:
+        The waves in loading order, and the modules left out because of a dependency cycle
+    """
+    pending = {info.name: info for info in infos}
+    done = set(loaded)
+    waves: list[list[str]] = []
+    while pending:
+        # Dependencies that are neither configured nor already loaded can't be waited for
+        ready = [info for info in pending.values() if all(dep in done or dep not in pending for dep in info.dependencies)]
+        if not ready:
+            break
+        priority = max(info.priority for info in ready)
+        wave = [info.name for info in ready if info.priority == priority]
+        waves.append(wave)
+        for name in wave:
+            done.add(name)
+            del pending[name]
+    return waves, set(pending)
+
+async def _load_module(bot: commands.Bot, name: str, package: str) -> None:
+    with profiling.phase("module", name):
+        await bot.load_extension(f"{package}.{name}.main")
+
+async def load_modules(bot: commands.Bot, modules: list[str], package: str = "plugins") -> dict[str, Exception | None]:
+    """
+    Load modules concurrently, in dependency and priority order.
+    A module whose dependency failed to load is not loaded.
+
+    Returns:
+        For each module, None if it has been loaded or the exception that prevented it
+    """
+    infos = [read_module_info(module, package) for module in dict.fromkeys(modules)]
+    loaded = {name.split(".")[1] for name in bot.extensions if name.startswith(f"{package}.")}
+    configured = {info.name for info in infos}
+    for info in infos:
+        for dep in info.dependencies - configured - loaded:
+            log.warning(f"Module `{info.name}` depends on `{dep}` which is not loaded")
+
+    waves, cyclic = plan_waves(infos, loaded)
+    results: dict[str, Exception | None] = {name: RuntimeError("Dependency cycle") for name in cyclic}
+    if cyclic:
+        log.error(f"Dependency cycle between modules {', '.join(f'`{name}`' for name in sorted(cyclic))}, they are not loaded")
+
+    dependencies = {info.name: info.dependencies for info in infos}
+    for wave in waves:
+        to_load = []
+        for name in wave:
+            failed = [dep for dep in dependencies[name] if results.get(dep) is not None]
+            if failed:
+                results[name] = RuntimeError(f"Dependency `{failed[0]}` failed to load")
+            else:
+                to_load.append(name)
+        outcomes = await asyncio.gather(*(_load_module(bot, name, package) for name in to_load), return_exceptions=True)
+        for name, outcome in zip(to_load, outcomes):
+            if isinstance(outcome, BaseException) and not isinstance(outcome, Exception):
+                raise outcome
+            results[name] = outcome
+    return results
+
+async def unload_modules(bot: commands.Bot, package: str = "plugins") -> None:
+    """
+    Unload every loaded module, dependent modules first so they can still use their dependencies while unloading.
+    """
+    loaded = [name.split(".")[1] for name in bot.extensions if name.startswith(f"{package}.")]
+    waves, cyclic = plan_waves([read_module_info(name, package) for name in loaded])
+    for wave in [sorted(cyclic)] + waves[::-1]:
+        for name in wave:
+            try:
+                await bot.unload_extension(f"{package}.{name}.main")
+                log.info(f"Module `{name}` unloaded.")
+            except Exception as e:
+                log.error(f"Failed to unload module `{name}`: {e}")
@@ -5,7 +5,12 @@
 # file, You can obtain one at https://mozilla.org/MPL/2.0/.
 
 from pathlib import Path
+from typing import Any
+import asyncio
+import atexit
+import copy
 import json
+import threading
 from dismob import log
 import os
 
@@ -18,26 +23,169 @@ def getConfigDir() -> str:
         log.info(f"Config directory has been set to `{config_dir}`")
     return config_dir
 
+class JsonCache:
+    """
+    In-memory cache of parsed json files.
+    Loading returns a copy of the cached data and saving caches a copy, so callers never share an object.
+    Saving only updates the cache and marks the file dirty, it is written once no other save happened
+    for `save_delay` seconds, on a worker thread, through a temporary file renamed over the original
+    so a crash can never leave it half written. Without a running event loop, saves are written right away.
+    The `*_async` methods do the file I/O in a worker thread and wait for it.
+    """
+    def __init__(self, save_delay: float = 1.0):
+        self.save_delay = save_delay
+        self._data: dict[str, Any] = {}
+        self._dirty: set[str] = set()
+        self._timers: dict[str, asyncio.TimerHandle] = {}
+        self._versions: dict[str, int] = {}
+        self._written_versions: dict[str, int] = {}
+        self._file_locks: dict[str, threading.Lock] = {}
+        self._load_locks: dict[str, asyncio.Lock] = {}
+        self._directories: set[str] = set()
+
+    def ensure_directory(self, dir_path: str) -> None:
+        if dir_path not in self._directories:
+            Path(dir_path).mkdir(parents=True, exist_ok=True)
+            self._directories.add(dir_path)
+
+    def _read(self, dirpath: str, path: str):
+        self.ensure_directory(dirpath)
+        try:
+            with open(path, "r") as file:
+                return json.load(file)
+        except Exception as e:
+            log.error(f"Failed to load json file '{path}': {e}")
+            return None
+
+    def load(self, dirpath: str, filename: str):
+        path = f"{dirpath}/{filename}"
+        if path not in self._data:
+            data = self._read(dirpath, path)
+            if data is None:
+                # Not cached, the file may be fixed or created meanwhile
+                return None
+            self._data[path] = data
+        return copy.deepcopy(self._data[path])
+
+    async def load_async(self, dirpath: str, filename: str):
+        path = f"{dirpath}/{filename}"
+        if path in self._data:
+            return copy.deepcopy(self._data[path])
+        # Concurrent loads of the same file wait for the first one instead of reading it again
+        async with self._load_locks.setdefault(path, asyncio.Lock()):
+            if path not in self._data:
+                data = await asyncio.to_thread(self._read, dirpath, path)
+                if data is None:
+                    return None
+                # A save may have happened meanwhile, it is more recent than what was read
+                self._data.setdefault(path, data)
+        return copy.deepcopy(self._data[path])
+
+    def save(self, dirpath: str, filename: str, data) -> None:
+        path = f"{dirpath}/{filename}"
+        self._data[path] = copy.deepcopy(data)
+        self._dirty.add(path)
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.flush(path)
+            return
+        self._cancel_timer(path)
+        self._timers[path] = loop.call_later(self.save_delay, self._flush_in_background, path)
+
+    async def save_async(self, dirpath: str, filename: str, data) -> None:
+        """Save and write the file right away in a worker thread"""
+        path = f"{dirpath}/{filename}"
+        self._data[path] = copy.deepcopy(data)
+        self._dirty.add(path)
+        await self.flush_async(path)
+
+    def _cancel_timer(self, path: str) -> None:
+        timer = self._timers.pop(path, None)
+        if timer is not None:
+            timer.cancel()
+
+    def flush(self, path: str = None) -> None:
+        """Write the given dirty file (or all of them) right away, blocking the caller"""
+        paths = [path] if path is not None else list(self._dirty)
+        for dirty_path in paths:
+            self._cancel_timer(dirty_path)
+            snapshot = self._snapshot(dirty_path)
+            if snapshot is not None:
+                self._write(dirty_path, *snapshot)
+
+    async def flush_async(self, path: str = None) -> None:
+        """Write the given dirty file (or all of them) right away in a worker thread"""
+        paths = [path] if path is not None else list(self._dirty)
+        for dirty_path in paths:
+            self._cancel_timer(dirty_path)
+            snapshot = self._snapshot(dirty_path)
+            if snapshot is not None:
+                await asyncio.to_thread(self._write, dirty_path, *snapshot)
+
+    def _flush_in_background(self, path: str) -> None:
+        self._timers.pop(path, None)
+        snapshot = self._snapshot(path)
+        if snapshot is not None:
+            asyncio.get_running_loop().run_in_executor(None, self._write, path, *snapshot)
+
+    def _snapshot(self, path: str) -> tuple[str, int] | None:
+        """Serialize a dirty file on the caller's thread, so the data can't change while being dumped"""
+        if path not in self._dirty:
+            return None
+        self._dirty.discard(path)
+        try:
+            text = json.dumps(self._data[path], indent = 4)
+        except Exception as e:
+            log.error(f"Failed to save json file '{path}': {e}")
+            return None
+        version = self._versions.get(path, 0) + 1
+        self._versions[path] = version
+        return text, version
+
+    def _write(self, path: str, text: str, version: int) -> None:
+        # Per-file lock, so concurrent writes from different threads are serialized
+        with self._file_locks.setdefault(path, threading.Lock()):
+            if self._written_versions.get(path, 0) >= version:
+                # A more recent snapshot has already been written
+                return
+            tmp_path = f"{path}.tmp"
+            try:
+                self.ensure_directory(os.path.dirname(path))
+                with open(tmp_path, "w") as file:
+                    file.write(text)
+                    file.flush()
+                    os.fsync(file.fileno())
+                os.replace(tmp_path, path)
+                self._written_versions[path] = version
+            except Exception as e:
+                log.error(f"Failed to save json file '{path}': {e}")
+
+cache = JsonCache()
+atexit.register(cache.flush)
+
 def ensure_directory(dir_path: str) -> None:
-    Path(dir_path).mkdir(parents=True, exist_ok=True)
+    cache.ensure_directory(dir_path)
 
 def openJson(dirpath: str, filename: str):
-    ensure_directory(dirpath)
-    data = None
-    try:
-        with open(f"{dirpath}/{filename}", "r") as file:
-            data = json.load(file)
-    except Exception as e:
-        log.error(f"Failed to load json file '{dirpath}/{filename}': {e}")
-    return data
+    return cache.load(dirpath, filename)
 
 def saveJson(dirpath: str, filename: str, data) -> None:
-    ensure_directory(dirpath)
-    try:
-        with open(f"{dirpath}/{filename}", "w+") as file:
-            json.dump(data, file, indent = 4)
-    except Exception as e:
-        log.error(f"Failed to save json file '{dirpath}/{filename}': {e}")
+    cache.save(dirpath, filename, data)
+
+def flush() -> None:
+    """Write all pending json saves right away"""
+    cache.flush()
+
+async def openJsonAsync(dirpath: str, filename: str):
+    return await cache.load_async(dirpath, filename)
+
+async def saveJsonAsync(dirpath: str, filename: str, data) -> None:
+    await cache.save_async(dirpath, filename, data)
+
+async def flushAsync() -> None:
+    """Write all pending json saves in a worker thread"""
+    await cache.flush_async()
 
 def getConfigFilename(module: str = None) -> str:
     return f"config{f'.{module}' if module else ''}.json"
@@ -47,3 +195,9 @@ def openConfig(module: str = None) -> dict:
 
 def saveConfig(data, module: str = None) -> None:
     saveJson(getConfigDir(), getConfigFilename(module), data)
+
+async def openConfigAsync(module: str = None) -> dict:
+    return await openJsonAsync(getConfigDir(), getConfigFilename(module)) or dict()
+
+async def saveConfigAsync(data, module: str = None) -> None:
+    await saveJsonAsync(getConfigDir(), getConfigFilename(module), data)
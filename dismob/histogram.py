@@ -0,0 +1,50 @@
+# Copyright (c) 2025 Benoît Pelletier
+# SPDX-License-Identifier: MPL-2.0
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+import math
+from dataclasses import dataclass, field
+
+@dataclass
+class LatencyHistogram:
+    """
+    Latency histogram with fixed-size logarithmic buckets, from 1ms up to about 2 minutes.
+    Percentiles are given as the upper bound of the bucket they fall in (at most 25% above the real value).
+    """
+    min_value: float = 0.001
+    growth: float = 1.25
+    size: int = 54
+    counts: list = field(default_factory=list)
+    count: int = 0
+    total: float = 0.0
+    
+    def __post_init__(self):
+        if not self.counts:
+            self.counts = [0] * self.size
+    
+    def record(self, value: float) -> None:
+        if value <= self.min_value:
+            index = 0
+        else:
+            index = min(self.size - 1, math.ceil(math.log(value / self.min_value) / math.log(self.growth)))
+        self.counts[index] += 1
+        self.count += 1
+        self.total += value
+    
+    @property
+    def average(self) -> float:
+        return self.total / self.count if self.count > 0 else 0.0
+    
+    def percentile(self, percent: float) -> float:
+        """Value below which `percent` % of the recorded values fall"""
+        if self.count == 0:
+            return 0.0
+        rank = self.count * percent / 100
+        cumulated = 0
+        for index, bucket_count in enumerate(self.counts):
+            cumulated += bucket_count
+            if cumulated >= rank:
+                return self.min_value * (self.growth ** index)
+        return self.min_value * (self.growth ** (self.size - 1))
@@ -77,7 +77,7 @@ def parse_kwargs(kwargs: str) -> dict[str, str]:
     if str_ctx:
         raise UnexpectedToken(f"Missing token `\"` at the end of value\n{show_index(kwargs, len(kwargs))}")
 
-    log.info(f"key: {key} | value: {value}")
+    log.info("key: %s | value: %s", key, value)
     # Write last key=value since there is no space to end.
     if len(key) > 0:
         result[key] = value
@@ -4,14 +4,13 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at https://mozilla.org/MPL/2.0/.
 
+# babel, dateutil and pytz are slow to import, they are imported by the functions that need them
+
 import os
-import babel.dates
-import dateutil.parser
-import pytz
-from datetime import datetime
+from datetime import datetime, timezone
 
 def now() -> datetime:
-    return datetime.now(tz=babel.dates.UTC)
+    return datetime.now(tz=timezone.utc)
 
 def parse_date(date: str) -> datetime | None:
     """
@@ -19,6 +18,7 @@ def parse_date(date: str) -> datetime | None:
     Handles both ISO format and other common formats.
     Returns None if parsing fails.
     """
+    import dateutil.parser
     try:
         # Always use dateutil.parser for robust parsing (handles ISO, with/without tz)
         return dateutil.parser.isoparse(date)
@@ -37,6 +37,8 @@ def format_date(date: str | datetime) -> str | None:
     else:
         dt = date
 
+    import babel.dates
+    import pytz
     tz = os.getenv("TZ")
     locale_str = os.getenv("LOCALE")
     return babel.dates.format_datetime(dt, locale=locale_str, tzinfo=pytz.timezone(tz))
@@ -4,25 +4,214 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at https://mozilla.org/MPL/2.0/.
 
-import discord
-from discord.ext import commands
-from discord.interactions import MISSING as MISSING
-from dismob.rate_limiter import get_rate_limiter
+from __future__ import annotations
+import atexit
+import copy
+import datetime
+import gzip
+import json
 import logging
+import logging.handlers
 import os
+import queue
+import shutil
+import time
+import warnings
+from typing import TYPE_CHECKING
+
+# discord is imported on first use, so tools that only log or read configs don't load it
+if TYPE_CHECKING:
+    import discord
+    from discord.ext import commands
 
 logger: logging.Logger = None
+listener: logging.handlers.QueueListener = None
 
 # --- Logging configuration ---
 
+class BoundedQueueHandler(logging.handlers.QueueHandler):
+    """
+    Queue handler pushing records to a bounded queue, handled by a listener thread.
+    When the queue is full, records are either dropped (policy `drop`) or the caller blocks until there is room (policy `block`).
+    """
+    def __init__(self, log_queue: queue.Queue, policy: str = "drop"):
+        super().__init__(log_queue)
+        self.block = policy.lower() == "block"
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Only merge the arguments into the message here, as they may change before the listener
+        # handles the record. Formatting (time, colors, traceback) is left to the listener's handlers.
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        if self.block:
+            self.queue.put(record)
+            return
+        try:
+            if self.dropped > 0:
+                self.queue.put_nowait(logging.makeLogRecord({
+                    "name": record.name,
+                    "levelno": logging.WARNING,
+                    "levelname": "WARNING",
+                    "msg": f"{self.dropped} log records dropped, the log queue was full",
+                }))
+                self.dropped = 0
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+class BatchingQueueListener(logging.handlers.QueueListener):
+    """Queue listener flushing its handlers only when the queue runs empty, instead of after every record"""
+    def dequeue(self, block: bool) -> logging.LogRecord:
+        if block and self.queue.empty():
+            for handler in self.handlers:
+                handler.flush()
+        return self.queue.get(block=block)
+
+    def enqueue_sentinel(self) -> None:
+        # Wait for room when the queue is full, so stop() still joins the thread and writes out what is queued
+        self.queue.put(self._sentinel)
+
+class FieldsFormatter(logging.Formatter):
+    """Formatter appending the structured fields of a record to its message as `key=value` pairs"""
+    def formatMessage(self, record: logging.LogRecord) -> str:
+        message = super().formatMessage(record)
+        fields = getattr(record, "fields", None)
+        if fields:
+            message += " " + " ".join(f"{key}={value}" for key, value in fields.items())
+        return message
+
+class JsonFormatter(logging.Formatter):
+    """Formatter writing each record as a single line JSON object, structured fields included"""
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "time": datetime.datetime.fromtimestamp(record.created, tz=datetime.timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        fields = getattr(record, "fields", None)
+        if fields:
+            data.update(fields)
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            data["exception"] = record.exc_text
+        if record.stack_info:
+            data["stack"] = self.formatStack(record.stack_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+class BatchedFlushMixin:
+    """Stream handler mixin deferring flushes to every `flush_batch` records (or an explicit flush)"""
+    flush_batch: int = 100
+    _pending: int = 0
+    _emitting: bool = False
+
+    def emit(self, record: logging.LogRecord) -> None:
+        self._emitting = True
+        try:
+            super().emit(record)
+        finally:
+            self._emitting = False
+        self._pending += 1
+        if self._pending >= self.flush_batch:
+            self.flush()
+
+    def flush(self) -> None:
+        if self._emitting:
+            # Called by StreamHandler.emit after each record
+            return
+        self._pending = 0
+        super().flush()
+
+class BatchedFileHandler(BatchedFlushMixin, logging.FileHandler):
+    pass
+
+def compress_file(source: str, dest: str) -> None:
+    """Gzip `source` into `dest` then remove `source`"""
+    try:
+        with open(source, "rb") as f_in, gzip.open(dest, "wb") as f_out:
+            shutil.copyfileobj(f_in, f_out)
+        os.remove(source)
+    except Exception as e:
+        logging.getLogger(__name__).error(f"Failed to compress log file '{source}': {e}")
+
+class RotatingLogFileHandler(BatchedFlushMixin, logging.handlers.RotatingFileHandler):
+    """
+    File handler rotating when the file exceeds `max_bytes` and/or every `when` period
+    (`H` hourly, `D` daily, `W` weekly or `MIDNIGHT`), keeping `backup_count` numbered backups.
+    Rotated files are gzip compressed, on the log listener thread so logging callers never wait for it.
+    """
+    PERIODS = {"H": 3600, "D": 86400, "W": 7 * 86400}
+
+    def __init__(self, filename: str, max_bytes: int = 0, when: str = "", backup_count: int = 5, compress: bool = True, encoding: str = None):
+        super().__init__(filename, maxBytes=max_bytes, backupCount=backup_count, encoding=encoding)
+        self.when = when.upper()
+        if self.when and self.when != "MIDNIGHT" and self.when not in self.PERIODS:
+            raise ValueError(f"Invalid log rotation period `{when}`, expected one of H, D, W or MIDNIGHT")
+        # Like TimedRotatingFileHandler, count the period from the last write to the file
+        last_write = os.stat(filename).st_mtime if os.path.exists(filename) else time.time()
+        self.rollover_at = self.compute_rollover(last_write)
+        if compress:
+            self.namer = lambda name: f"{name}.gz"
+            self.rotator = self.compress_rotator
+
+    def compute_rollover(self, current_time: float) -> float:
+        if not self.when:
+            return float("inf")
+        if self.when == "MIDNIGHT":
+            next_day = datetime.date.fromtimestamp(current_time) + datetime.timedelta(days=1)
+            return datetime.datetime.combine(next_day, datetime.time()).timestamp()
+        return current_time + self.PERIODS[self.when]
+
+    def shouldRollover(self, record: logging.LogRecord) -> bool:
+        if time.time() >= self.rollover_at:
+            return True
+        return super().shouldRollover(record)
+
+    def doRollover(self) -> None:
+        super().doRollover()
+        self.rollover_at = self.compute_rollover(time.time())
+
+    def compress_rotator(self, source: str, dest: str) -> None:
+        # Compressed before the next rollover shifts the backups, so they can't be mixed up
+        compress_file(source, dest)
+
+def shutdown() -> None:
+    """Stop the log listener thread, writing out all queued records"""
+    global listener
+    if listener is not None:
+        listener.stop()
+        listener = None
+
 def setup_logger(
     logger_name: str = "DungeonBot",
     file_level: str = "INFO",
-    console_level: str = "INFO"
+    console_level: str = "INFO",
+    queue_size: int = 10000,
+    queue_policy: str = "drop",
+    flush_batch: int = 100,
+    rotate_bytes: int = 0,
+    rotate_when: str = "",
+    backup_count: int = 5,
+    compress: bool = True,
+    file_format: str = "text"
 ) -> None:
     """
     Set up and return a logger with the given name and logging levels.
     Levels should be strings like 'INFO', 'DEBUG', etc.
+    Records are written by a background thread, `queue_size` bounds the pending records
+    and `queue_policy` (`drop` or `block`) tells what to do when it is full.
+    The log file is rotated past `rotate_bytes` and/or every `rotate_when` period (see `RotatingLogFileHandler`),
+    keeping `backup_count` rotated files, gzip compressed if `compress` is set.
+    `file_format` is either `text` or `json` (one JSON object per line, for machine ingestion).
     """
     LOG_FILE = os.path.abspath(os.path.join(os.path.dirname(os.path.dirname(__file__)), "bot.log"))
     logLevels = logging.getLevelNamesMapping()
@@ -34,17 +223,24 @@ def setup_logger(
     logger.setLevel(min(file_logLevel, console_logLevel))
 
     # File handler
-    file_handler = logging.FileHandler(LOG_FILE, encoding="utf-8")
+    if rotate_bytes > 0 or rotate_when:
+        file_handler = RotatingLogFileHandler(LOG_FILE, rotate_bytes, rotate_when, backup_count, compress, encoding="utf-8")
+    else:
+        file_handler = BatchedFileHandler(LOG_FILE, encoding="utf-8")
+    file_handler.flush_batch = flush_batch
     file_handler.setLevel(file_logLevel)
-    file_formatter = logging.Formatter(
-        "%(asctime)s [%(levelname)-8s] %(name)s: %(message)s",
-        datefmt="%Y-%m-%d %H:%M:%S"
-    )
+    if file_format.lower() == "json":
+        file_formatter = JsonFormatter()
+    else:
+        file_formatter = FieldsFormatter(
+            "%(asctime)s [%(levelname)-8s] %(name)s: %(message)s",
+            datefmt="%Y-%m-%d %H:%M:%S"
+        )
     file_handler.setFormatter(file_formatter)
 
     # Console handler
 
-    class ColorFormatter(logging.Formatter):
+    class ColorFormatter(FieldsFormatter):
         COLORS = {
             "DEBUG": "\033[36m",    # CYAN
             "INFO": "\033[34m",     # Blue
@@ -81,13 +277,20 @@ def setup_logger(
 
     # Add handlers if not already present
     if not logger.hasHandlers():
-        logger.addHandler(file_handler)
-        logger.addHandler(console_handler)
+        # Handlers run on the listener thread so disk writes never block the event loop
+        global listener
+        log_queue = queue.Queue(maxsize=queue_size)
+        listener = BatchingQueueListener(log_queue, file_handler, console_handler, respect_handler_level=True)
+        listener.start()
+        atexit.register(shutdown)
+        logger.addHandler(BoundedQueueHandler(log_queue, queue_policy))
 
 # --- Client message helpers ---
 
-async def client(ctx: commands.Context | discord.Interaction, msg: str, title: str = None, color: discord.Colour = discord.Color.blurple(), delete_after: int = 5):
-    e = discord.Embed(title=title, color=color, description=msg)
+async def client(ctx: commands.Context | discord.Interaction, msg: str, title: str = None, color: discord.Colour | None = None, delete_after: int = 5):
+    import discord
+    from discord.ext import commands
+    e = discord.Embed(title=title, color=color if color is not None else discord.Color.blurple(), description=msg)
     if isinstance(ctx, commands.Context):
         e.set_footer(text=f"Commande faites par {ctx.author.display_name}", icon_url=ctx.author.display_avatar)
         return await ctx.send(embed=e, delete_after=delete_after)
@@ -95,14 +298,20 @@ async def client(ctx: commands.Context | discord.Interaction, msg: str, title: s
         return await safe_respond(ctx, embed=e, ephemeral=True)
 
 async def success(ctx: commands.Context | discord.Interaction, msg: str, delete_after: int = 5):
+    import discord
     info(msg)
     return await client(ctx, f"{msg}", title=":white_check_mark: Success", color=discord.Color.green(), delete_after=delete_after)
     
 async def failure(ctx: commands.Context | discord.Interaction, msg: str, delete_after: int = 5, stacktrace: bool = False):
-    error(msg, stacktrace)
+    import discord
+    error(msg, stacktrace=stacktrace)
     return await client(ctx, f"{msg}", title=":x: Error", color=discord.Color.red(), delete_after=delete_after)
 
 # --- Logging functions ---
+# Messages are %-style templates formatted with `args` only when the record is emitted,
+# e.g. `log.info("Message sent in %s", channel.name, channel_id=channel.id)`.
+# Keyword arguments are structured fields, appended to text logs and merged into JSON logs.
+
 def require_logger(func):
     def wrapper(msg: str, *args, **kwargs):
         if logger is None:
@@ -111,48 +320,75 @@ def require_logger(func):
     return wrapper
 
 @require_logger
-def debug(msg: str) -> None:
-    logger.debug(msg)
+def debug(msg: str, *args, **fields) -> None:
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(msg, *args, extra={"fields": fields} if fields else None, stacklevel=3)
 
 @require_logger
-def info(msg: str) -> None:
-    logger.info(msg)
+def info(msg: str, *args, **fields) -> None:
+    if logger.isEnabledFor(logging.INFO):
+        logger.info(msg, *args, extra={"fields": fields} if fields else None, stacklevel=3)
 
 @require_logger
-def warning(msg: str) -> None:
-    logger.warning(msg)
+def warning(msg: str, *args, **fields) -> None:
+    if logger.isEnabledFor(logging.WARNING):
+        logger.warning(msg, *args, extra={"fields": fields} if fields else None, stacklevel=3)
 
 @require_logger
-def error(msg: str, stacktrace: bool = True) -> None:
-    logger.error(msg, stack_info=stacktrace, stacklevel=3)
+def error(msg: str, *args, stacktrace: bool = False, **fields) -> None:
+    """
+    Log an error. The stack of the caller is only captured with `stacktrace=True`,
+    walking it on every call is not worth it for errors that already describe their cause.
+    """
+    if len(args) == 1 and isinstance(args[0], bool) and "%" not in msg:
+        # Former `error(msg, stacktrace)` form, kept for the plugins written against it
+        warnings.warn("log.error(msg, stacktrace) is deprecated, pass stacktrace= by keyword", DeprecationWarning, stacklevel=3)
+        stacktrace, args = args[0], ()
+    if logger.isEnabledFor(logging.ERROR):
+        logger.error(msg, *args, stack_info=stacktrace, extra={"fields": fields} if fields else None, stacklevel=3)
 
 # --- Discord helpers ---
 
+def _rate_limiter():
+    # Imported on first use, so tools that only log or read configs don't load it
+    from dismob.rate_limiter import get_rate_limiter
+    return get_rate_limiter()
+
 def missing_if_none(value):
     """Returns MISSING if value is None, else returns the value"""
+    from discord.interactions import MISSING
     return MISSING if value is None else value
 
-async def safe_send_message(channel: discord.TextChannel, content: str | None = None, embed: discord.Embed | None = None, view: discord.ui.View | None = None, file: discord.File | None = None) -> discord.Message | None:
-    """Sends a message to a channel with rate limiting"""
+async def safe_send_message(channel: discord.TextChannel, content: str | None = None, embed: discord.Embed | None = None, view: discord.ui.View | None = None, file: discord.File | None = None, coalesce: bool = False) -> discord.Message | None:
+    """
+    Sends a message to a channel with rate limiting.
+    With `coalesce`, the text and embed may be merged with other messages sent to the channel within a short window
+    (not possible with a view or a file), the returned message is then the merged one.
+    """
+    import discord
     try:
-        result = await get_rate_limiter().safe_send(channel, content, embed=embed, view=view, file=file)
-        info(f"Message sent in {channel.name}")
+        if coalesce and view is None and file is None:
+            result = await _rate_limiter().safe_send_coalesced(channel, content, embed)
+        else:
+            result = await _rate_limiter().safe_send(channel, content, embed=embed, view=view, file=file)
+        info("Message sent in %s", channel.name, channel_id=channel.id)
         return result
     except discord.Forbidden:
-        error(f"Bot has not the permission to send messages in {channel.name}")
+        error("Bot has not the permission to send messages in %s", channel.name, channel_id=channel.id)
         return None
     except discord.NotFound:
-        error(f"Channel {channel.name} not found")
+        error("Channel %s not found", channel.name, channel_id=channel.id)
         return None
     except Exception as e:
-        error(f"Error when sending message: {e}")
+        error("Error when sending message: %s", e, channel_id=channel.id)
         return None
 
 async def safe_respond(interaction: discord.Interaction, content: str | None = None, embed: discord.Embed | None = None, view: discord.ui.View | None = None, file: discord.File | None = None, ephemeral: bool = False):
     """Responds to an interaction with rate limiting"""
+    import discord
     try:
-        return await get_rate_limiter().execute_request(
-            interaction.response.send_message(content, embed=missing_if_none(embed), view=missing_if_none(view), file=missing_if_none(file), ephemeral=ephemeral),
+        return await _rate_limiter().execute_request(
+            lambda: interaction.response.send_message(content, embed=missing_if_none(embed), view=missing_if_none(view), file=missing_if_none(file), ephemeral=ephemeral),
             route='POST /interactions/{interaction_id}/{interaction_token}/callback',
             major_params={'interaction_id': interaction.id}
         )
@@ -160,15 +396,22 @@ async def safe_respond(interaction: discord.Interaction, content: str | None = N
         # Use followup if already responded
         await safe_followup(interaction, content, embed, view, file, ephemeral)
     except Exception as e:
-        error(f"Error when responding to the interaction: {e}")
+        error("Error when responding to the interaction: %s", e, guild_id=interaction.guild_id, channel_id=interaction.channel_id)
 
 async def safe_followup(interaction: discord.Interaction, content: str | None = None, embed: discord.Embed | None = None, view: discord.ui.View | None = None, file: discord.File | None = None, ephemeral: bool = False):
     """Sends a followup message to an interaction with rate limiting"""
     try:
-        return await get_rate_limiter().execute_request(
-            interaction.followup.send(content, embed=missing_if_none(embed), view=missing_if_none(view), file=missing_if_none(file), ephemeral=ephemeral),
+        return await _rate_limiter().execute_request(
+            lambda: interaction.followup.send(content, embed=missing_if_none(embed), view=missing_if_none(view), file=missing_if_none(file), ephemeral=ephemeral),
             route='POST /webhooks/{application_id}/{interaction_token}',
             major_params={'application_id': interaction.application_id}
         )
     except Exception as e:
-        error(f"Error during the followup: {e}")
+        error("Error during the followup: %s", e, guild_id=interaction.guild_id, channel_id=interaction.channel_id)
+
+def __getattr__(name: str):
+    # `log.MISSING` is kept available without importing discord with this module
+    if name == 'MISSING':
+        from discord.interactions import MISSING
+        return MISSING
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,200 @@
+# Copyright (c) 2025 Benoît Pelletier
+# SPDX-License-Identifier: MPL-2.0
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+import asyncio
+import math
+import time
+from aiohttp import web
+import discord
+from discord.ext import commands
+from dismob import log, tasks
+from dismob.histogram import LatencyHistogram
+from dismob.rate_limiter import get_rate_limiter
+
+def _escape_label(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _labels(labels: dict[str, str] | None) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape_label(value)}"' for key, value in labels.items()) + "}"
+
+class MetricsWriter:
+    """
+    Build a Prometheus text exposition.
+    Samples are grouped by metric family, whatever the order they are written in, as the format requires.
+    """
+
+    def __init__(self):
+        # Family name -> its HELP, TYPE and sample lines, in order of first use
+        self.families: dict[str, list[str]] = {}
+
+    def _family(self, name: str, kind: str, help: str) -> list[str]:
+        lines = self.families.get(name)
+        if lines is None:
+            lines = self.families[name] = [f"# HELP {name} {help}", f"# TYPE {name} {kind}"]
+        return lines
+
+    def counter(self, name: str, help: str, value: float, labels: dict[str, str] | None = None) -> None:
+        self._family(name, "counter", help).append(f"{name}{_labels(labels)} {value}")
+
+    def gauge(self, name: str, help: str, value: float, labels: dict[str, str] | None = None) -> None:
+        self._family(name, "gauge", help).append(f"{name}{_labels(labels)} {value}")
+
+    def histogram(self, name: str, help: str, histogram: LatencyHistogram, labels: dict[str, str] | None = None) -> None:
+        lines = self._family(name, "histogram", help)
+        labels = labels or {}
+        cumulated = 0
+        for index, count in enumerate(histogram.counts[:-1]):
+            cumulated += count
+            bound = histogram.min_value * (histogram.growth ** index)
+            lines.append(f"{name}_bucket{_labels({**labels, 'le': f'{bound:.6g}'})} {cumulated}")
+        lines.append(f"{name}_bucket{_labels({**labels, 'le': '+Inf'})} {histogram.count}")
+        lines.append(f"{name}_sum{_labels(labels)} {histogram.total}")
+        lines.append(f"{name}_count{_labels(labels)} {histogram.count}")
+
+    def render(self) -> str:
+        return "\n".join(line for lines in self.families.values() for line in lines) + "\n"
+
+class MetricsExporter:
+    """
+    Local HTTP endpoint exposing the bot internal metrics at `/metrics`, in Prometheus text format.
+    Exposes rate limiter counters, event loop lag, loaded modules and per-command latency.
+    """
+
+    def __init__(self, bot: commands.Bot, host: str = "127.0.0.1", port: int = 9100, lag_interval: float = 1.0):
+        self.bot = bot
+        self.host = host
+        self.port = port
+        self.lag_interval = lag_interval
+        self.loop_lag: float = 0.0
+        self.loop_lag_max: float = 0.0
+        self.command_latency: dict[str, LatencyHistogram] = {}
+        self.command_errors: dict[str, int] = {}
+        self._runner: web.AppRunner | None = None
+        self._lag_task: asyncio.Task | None = None
+
+    @property
+    def is_running(self) -> bool:
+        return self._runner is not None
+
+    async def start(self) -> None:
+        """Start the HTTP endpoint and the event loop lag monitor, does nothing if already running"""
+        if self.is_running:
+            return
+        app = web.Application()
+        app.router.add_get("/metrics", self._handle_metrics)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        self._lag_task = asyncio.create_task(self._monitor_loop_lag(), name="metrics:loop-lag")
+        self.bot.add_listener(self.on_command, "on_command")
+        self.bot.add_listener(self.on_command_completion, "on_command_completion")
+        self.bot.add_listener(self.on_command_error, "on_command_error")
+        self.bot.add_listener(self.on_app_command_completion, "on_app_command_completion")
+        log.info(f"Metrics exposed on http://{self.host}:{self.port}/metrics")
+
+    async def stop(self) -> None:
+        """Stop the HTTP endpoint and the event loop lag monitor"""
+        if not self.is_running:
+            return
+        self.bot.remove_listener(self.on_command, "on_command")
+        self.bot.remove_listener(self.on_command_completion, "on_command_completion")
+        self.bot.remove_listener(self.on_command_error, "on_command_error")
+        self.bot.remove_listener(self.on_app_command_completion, "on_app_command_completion")
+        if self._lag_task is not None:
+            self._lag_task.cancel()
+            self._lag_task = None
+        await self._runner.cleanup()
+        self._runner = None
+
+    async def _monitor_loop_lag(self) -> None:
+        """Measure how late the event loop wakes up a sleeping task"""
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.lag_interval)
+            self.loop_lag = max(0.0, loop.time() - start - self.lag_interval)
+            self.loop_lag_max = max(self.loop_lag_max, self.loop_lag)
+
+    # --- Command listeners ---
+
+    def _record_command(self, name: str, duration: float) -> None:
+        histogram = self.command_latency.get(name)
+        if histogram is None:
+            histogram = self.command_latency[name] = LatencyHistogram()
+        histogram.record(duration)
+
+    async def on_command(self, ctx: commands.Context) -> None:
+        ctx.dismob_started_at = time.perf_counter()
+
+    async def on_command_completion(self, ctx: commands.Context) -> None:
+        started_at = getattr(ctx, "dismob_started_at", None)
+        if started_at is not None and ctx.command is not None:
+            self._record_command(ctx.command.qualified_name, time.perf_counter() - started_at)
+
+    async def on_command_error(self, ctx: commands.Context, error: commands.CommandError) -> None:
+        if ctx.command is not None:
+            name = ctx.command.qualified_name
+            self.command_errors[name] = self.command_errors.get(name, 0) + 1
+
+    async def on_app_command_completion(self, interaction: discord.Interaction, command: discord.app_commands.Command | discord.app_commands.ContextMenu) -> None:
+        # No hook before app commands run, measure from the interaction creation instead
+        self._record_command(f"/{command.qualified_name}", (discord.utils.utcnow() - interaction.created_at).total_seconds())
+
+    # --- Exposition ---
+
+    async def _handle_metrics(self, request: web.Request) -> web.Response:
+        return web.Response(text=self.render(), content_type="text/plain", charset="utf-8", headers={"Cache-Control": "no-store"})
+
+    def render(self) -> str:
+        """Render all metrics in Prometheus text format"""
+        writer = MetricsWriter()
+        limiter = get_rate_limiter()
+        metrics = limiter.metrics
+
+        writer.counter("dismob_ratelimit_requests_total", "Requests issued through the rate limiter", metrics.total_requests)
+        writer.counter("dismob_ratelimit_rate_limited_total", "Requests answered with a 429", metrics.rate_limited_requests)
+        writer.counter("dismob_ratelimit_failed_total", "Requests that failed after retries", metrics.failed_requests)
+        writer.counter("dismob_ratelimit_retries_total", "Retry attempts", metrics.retry_attempts)
+        writer.gauge("dismob_ratelimit_buckets", "Rate limit buckets currently tracked", len(limiter.buckets))
+        writer.gauge("dismob_ratelimit_queued_requests", "Requests waiting in bucket queues", sum(len(queue) for queue in limiter._queues.values()))
+        writer.gauge("dismob_ratelimit_global_rate", "Current global requests per second allowed", limiter.global_rate)
+        writer.gauge("dismob_ratelimit_global_limited", "Whether the global rate limit is hit", int(limiter.global_limit.is_rate_limited))
+        writer.gauge("dismob_ratelimit_invalid_requests", "401, 403 and 429 responses in the last 10 minutes", limiter.invalid_requests.count)
+        writer.counter("dismob_coalesce_messages_total", "Messages given to the coalescing sender", limiter.coalescer.messages)
+        writer.counter("dismob_coalesce_sent_total", "Messages actually sent by the coalescing sender", limiter.coalescer.sent)
+        for route, route_metrics in metrics.routes.items():
+            labels = {"route": route}
+            writer.counter("dismob_ratelimit_route_requests_total", "Requests issued per route", route_metrics.requests, labels)
+            writer.counter("dismob_ratelimit_route_rate_limited_total", "429 responses per route", route_metrics.rate_limited, labels)
+            writer.counter("dismob_ratelimit_route_server_errors_total", "5xx responses per route", route_metrics.server_errors, labels)
+            writer.histogram("dismob_ratelimit_request_duration_seconds", "Time on the wire per route", route_metrics.latency, labels)
+            writer.histogram("dismob_ratelimit_wait_duration_seconds", "Time queued behind rate limits per route", route_metrics.wait, labels)
+
+        writer.gauge("dismob_event_loop_lag_seconds", "Last measured event loop lag", self.loop_lag)
+        writer.gauge("dismob_event_loop_lag_max_seconds", "Maximum event loop lag measured", self.loop_lag_max)
+        # Latency is NaN until the first heartbeat
+        latency = self.bot.latency
+        writer.gauge("dismob_gateway_latency_seconds", "Gateway heartbeat latency", 0 if math.isnan(latency) else latency)
+        writer.gauge("dismob_extensions_loaded", "Extensions currently loaded", len(self.bot.extensions))
+        writer.gauge("dismob_guilds", "Guilds the bot is in", len(self.bot.guilds))
+
+        for supervisor in tasks.supervisors():
+            labels = {"supervisor": supervisor.name}
+            writer.gauge("dismob_tasks_running", "Background tasks running", supervisor.running, labels)
+            writer.gauge("dismob_tasks_queued", "Background tasks waiting for a free slot", supervisor.queued, labels)
+            writer.counter("dismob_tasks_completed_total", "Background tasks completed", supervisor.completed, labels)
+            writer.counter("dismob_tasks_failed_total", "Background tasks that raised an exception", supervisor.failed, labels)
+            writer.counter("dismob_tasks_rejected_total", "Background tasks rejected because too many were pending", supervisor.rejected, labels)
+            writer.histogram("dismob_task_duration_seconds", "Background task run time", supervisor.durations, labels)
+
+        for name, histogram in self.command_latency.items():
+            writer.histogram("dismob_command_duration_seconds", "Command execution time", histogram, {"command": name})
+        for name, count in self.command_errors.items():
+            writer.counter("dismob_command_errors_total", "Commands that raised an error", count, {"command": name})
+
+        return writer.render()
@@ -0,0 +1,162 @@
+# Copyright (c) 2025 Benoît Pelletier
+# SPDX-License-Identifier: MPL-2.0
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+# Startup timing, enabled with the STARTUP_PROFILE environment variable.
+# This module is imported before anything else so it must stay light: only the standard library at module level.
+
+from contextlib import contextmanager
+import importlib.abc
+import json
+import sys
+import time
+
+class _TimedLoader:
+    """Wrap a module loader to time its execution, everything else is forwarded to the original loader"""
+    def __init__(self, loader, profiler: "StartupProfiler"):
+        self._loader = loader
+        self._profiler = profiler
+
+    def __getattr__(self, name: str):
+        return getattr(self._loader, name)
+
+    def create_module(self, spec):
+        return self._loader.create_module(spec)
+
+    def exec_module(self, module) -> None:
+        self._profiler._import_started()
+        start = time.perf_counter()
+        try:
+            self._loader.exec_module(module)
+        finally:
+            self._profiler._import_finished(module.__name__, time.perf_counter() - start)
+
+class _ImportTimer(importlib.abc.MetaPathFinder):
+    """Finder placed first on `sys.meta_path`, it lets the other finders do the work and times the loading"""
+    def __init__(self, profiler: "StartupProfiler"):
+        self._profiler = profiler
+
+    def find_spec(self, fullname: str, path, target=None):
+        if not self._profiler.is_watched(fullname):
+            return None
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, "find_spec"):
+                continue
+            spec = finder.find_spec(fullname, path, target)
+            if spec is not None:
+                break
+        else:
+            return None
+        if spec.loader is not None and hasattr(spec.loader, "exec_module"):
+            spec.loader = _TimedLoader(spec.loader, self._profiler)
+        return spec
+
+class StartupProfiler:
+    """
+    Record the wall time of startup phases: imports, extensions loading, cogs initialization...
+    Imports are timed for `dismob` and `plugins` modules and for top level third party packages,
+    with their own time without the nested timed imports.
+    """
+    packages = ("dismob", "plugins")
+
+    def __init__(self):
+        self.enabled: bool = False
+        self.dump_path: str = None
+        self.records: list[dict] = []
+        self._started_at: float = time.perf_counter()
+        self._children: list[float] = []
+        self._finder: _ImportTimer = None
+
+    def enable(self, dump_path: str = "startup_profile.json") -> None:
+        if self.enabled:
+            return
+        self.enabled = True
+        self.dump_path = dump_path
+        self._finder = _ImportTimer(self)
+        sys.meta_path.insert(0, self._finder)
+        self._watch_cogs()
+
+    def is_watched(self, name: str) -> bool:
+        root = name.partition(".")[0]
+        if root in self.packages:
+            return True
+        return "." not in name and not name.startswith("_") and name not in sys.stdlib_module_names
+
+    def _watch_cogs(self) -> None:
+        # Time every cog construction, cogs are created by each module `setup` before being added to the bot
+        from discord.ext import commands
+        construct = commands.CogMeta.__call__
+        def timed_construct(cls, *args, **kwargs):
+            with self.phase("cog", cls.__name__):
+                return construct(cls, *args, **kwargs)
+        commands.CogMeta.__call__ = timed_construct
+
+    def _import_started(self) -> None:
+        self._children.append(0.0)
+
+    def _import_finished(self, name: str, seconds: float) -> None:
+        nested = self._children.pop()
+        if self._children:
+            self._children[-1] += seconds
+        self.records.append({"phase": "import", "name": name, "seconds": seconds, "self_seconds": seconds - nested})
+
+    def record(self, phase: str, name: str, seconds: float) -> None:
+        if self.enabled:
+            self.records.append({"phase": phase, "name": name, "seconds": seconds})
+
+    @contextmanager
+    def phase(self, phase: str, name: str):
+        """Time the wrapped block, does nothing when profiling is disabled"""
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(phase, name, time.perf_counter() - start)
+
+    @property
+    def elapsed(self) -> float:
+        return time.perf_counter() - self._started_at
+
+    def report(self) -> None:
+        """Log all records, slowest first, and write them to the dump file"""
+        if not self.enabled:
+            return
+        from dismob import log
+        total = self.elapsed
+        lines = [f"Startup profile, {total:.3f}s since process start:"]
+        for record in sorted(self.records, key=lambda record: record["seconds"], reverse=True):
+            line = f"  {record['phase']:<10} {record['name']:<40} {record['seconds'] * 1000:>9.1f} ms"
+            if "self_seconds" in record:
+                line += f" (self {record['self_seconds'] * 1000:.1f} ms)"
+            lines.append(line)
+        log.info("\n".join(lines))
+        self.dump(total)
+
+    def dump(self, total: float = None) -> None:
+        if not self.enabled or not self.dump_path:
+            return
+        from dismob import log
+        try:
+            with open(self.dump_path, "w") as file:
+                json.dump({"total_seconds": total if total is not None else self.elapsed, "records": self.records}, file, indent = 4)
+        except Exception as e:
+            log.error(f"Failed to write startup profile '{self.dump_path}': {e}")
+
+profiler = StartupProfiler()
+
+def enable(dump_path: str = "startup_profile.json") -> None:
+    profiler.enable(dump_path)
+
+def phase(phase: str, name: str):
+    return profiler.phase(phase, name)
+
+def report() -> None:
+    profiler.report()
+
+def dump() -> None:
+    profiler.dump()
@@ -1,21 +1,40 @@
 # modules/rate_limiter.py
 import asyncio
+import contextvars
+import functools
+import itertools
 import aiohttp
 import discord
 from discord.ext import commands
 import time
 import json
 import logging
-from typing import Dict, Optional, Tuple, Any, Callable, Union
+from typing import ClassVar, Dict, Optional, Tuple, Any, Awaitable, Callable, Union
 from dataclasses import dataclass, field
-from collections import defaultdict, deque
-import hashlib
+from collections import OrderedDict, deque
+from dismob.histogram import LatencyHistogram
 import os
 from datetime import datetime, timedelta
 import threading
 
 logger = logging.getLogger(__name__)
 
+# Route of the request currently awaited through the limiter, read back by the
+# aiohttp trace hooks to know which bucket a response belongs to.
+_current_request: contextvars.ContextVar[Optional[Tuple[str, Optional[Dict[str, Any]], Optional[int]]]] = contextvars.ContextVar(
+    'dismob_rate_limiter_request', default=None
+)
+
+# Parameters giving a route its own bucket per resource, following Discord's bucketing rules
+MAJOR_PARAMETERS = ('channel_id', 'guild_id', 'webhook_id', 'application_id', 'interaction_id')
+
+@functools.lru_cache(maxsize=4096)
+def _make_bucket_key(route: str, major_id: Any, shard_id: Optional[int]) -> str:
+    key = route if major_id is None else f"{route}:{major_id}"
+    if shard_id is not None:
+        return f"shard_{shard_id}:{key}"
+    return key
+
 @dataclass
 class RateLimitBucket:
     """Represents a Discord rate limit bucket"""
@@ -25,24 +44,182 @@ class RateLimitBucket:
     reset_at: float = 0.0
     bucket_hash: Optional[str] = None
     locked_until: float = 0.0
+    window_end: float = 0.0
+    last_used: float = field(default_factory=time.time)
     
     @property
     def is_rate_limited(self) -> bool:
         return time.time() < self.locked_until
     
+    @property
+    def is_active(self) -> bool:
+        """Whether the bucket still constrains requests (locked or within its current window)"""
+        return self.is_active_at(time.time())
+    
+    def is_active_at(self, now: float) -> bool:
+        return now < self.locked_until or now < self.window_end
+    
     @property
     def retry_after(self) -> float:
         return max(0, self.locked_until - time.time())
+    
+    def consume(self) -> None:
+        """Take one request from the current window, locking the bucket until reset when exhausted"""
+        now = time.time()
+        if self.remaining <= 0 and now >= self.window_end:
+            # The window has elapsed since the last headers, assume a full bucket
+            # and a window of the same length until new headers tell otherwise
+            self.remaining = self.limit
+            self.window_end = now + self.reset_after
+        self.remaining -= 1
+        if self.remaining <= 0:
+            self.locked_until = max(self.locked_until, self.window_end)
+
+class BucketStore:
+    """
+    LRU store of rate limit buckets, bounded in size and evicting buckets idle for longer than a TTL.
+    Active buckets are never evicted, the store may temporarily grow past its size to keep them.
+    """
+    
+    def __init__(self, max_size: int = 10000, ttl: float = 300.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._buckets: OrderedDict[str, RateLimitBucket] = OrderedDict()
+    
+    def get(self, key: str, default: Optional[RateLimitBucket] = None) -> Optional[RateLimitBucket]:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            return default
+        bucket.last_used = time.time()
+        self._buckets.move_to_end(key)
+        return bucket
+    
+    def __setitem__(self, key: str, bucket: RateLimitBucket) -> None:
+        bucket.last_used = time.time()
+        self._buckets[key] = bucket
+        self._buckets.move_to_end(key)
+        if len(self._buckets) > self.max_size:
+            self._evict_overflow()
+    
+    def __delitem__(self, key: str) -> None:
+        del self._buckets[key]
+    
+    def __contains__(self, key: str) -> bool:
+        return key in self._buckets
+    
+    def __len__(self) -> int:
+        return len(self._buckets)
+    
+    def items(self):
+        return self._buckets.items()
+    
+    def _evict_overflow(self) -> None:
+        """Evict least recently used inactive buckets until the store fits its size"""
+        overflow = len(self._buckets) - self.max_size
+        now = time.time()
+        # Least recently used first, stop as soon as enough buckets are found
+        evicted = list(itertools.islice((key for key, bucket in self._buckets.items() if not bucket.is_active_at(now)), overflow))
+        for key in evicted:
+            del self._buckets[key]
+    
+    def evict_expired(self) -> int:
+        """Evict inactive buckets unused for longer than the TTL, returns the number of evicted buckets"""
+        now = time.time()
+        expire = now - self.ttl
+        # Buckets are ordered by last use, the first one used after `expire` ends the search
+        expired = [
+            key for key, bucket in itertools.takewhile(lambda item: item[1].last_used < expire, self._buckets.items())
+            if not bucket.is_active_at(now)
+        ]
+        for key in expired:
+            del self._buckets[key]
+        return len(expired)
+
+@dataclass
+class QueuedRequest:
+    """A request waiting in a bucket queue"""
+    request: Callable[[], Awaitable[Any]]
+    route: str
+    major_params: Optional[Dict[str, Any]]
+    shard_id: Optional[int]
+    future: asyncio.Future
+    queued_at: float = field(default_factory=time.time)
 
 @dataclass 
 class GlobalRateLimit:
-    """Global rate limit state"""
+    """Global rate limit state, with a token bucket pacing requests below Discord's global limit"""
     locked_until: float = 0.0
     retry_after: float = 0.0
+    rate: float = 50.0
+    tokens: float = 50.0
+    last_refill: float = field(default_factory=time.time)
     
     @property
     def is_rate_limited(self) -> bool:
         return time.time() < self.locked_until
+    
+    def _refill(self, rate: float) -> None:
+        now = time.time()
+        self.tokens = min(rate, self.tokens + (now - self.last_refill) * rate)
+        self.last_refill = now
+    
+    def take(self, rate: float) -> float:
+        """Take a token if one is available, otherwise return how long to wait for the next one"""
+        self._refill(rate)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / rate
+    
+    def consume(self, rate: float) -> None:
+        """Take a token unconditionally, for requests we can't delay (may go into debt)"""
+        self._refill(rate)
+        self.tokens -= 1
+
+@dataclass
+class InvalidRequestTracker:
+    """
+    Rolling count of invalid (401, 403 and 429) responses.
+    Cloudflare temporarily bans an IP reaching 10 000 of them within 10 minutes.
+    """
+    threshold: int = 10000
+    window: float = 600.0
+    timestamps: deque = field(default_factory=deque)
+    
+    def _prune(self) -> None:
+        expire = time.time() - self.window
+        while self.timestamps and self.timestamps[0] < expire:
+            self.timestamps.popleft()
+    
+    def record(self) -> None:
+        self._prune()
+        self.timestamps.append(time.time())
+        if len(self.timestamps) == self.threshold // 2:
+            logger.warning(f"Half of the invalid request budget used ({len(self.timestamps)}/{self.threshold} in {self.window:.0f}s), throttling requests")
+    
+    @property
+    def count(self) -> int:
+        self._prune()
+        return len(self.timestamps)
+    
+    @property
+    def throttle_factor(self) -> float:
+        """Rate multiplier, going down from 1 at half the budget to 0.05 when it is exhausted"""
+        usage = self.count / self.threshold
+        if usage <= 0.5:
+            return 1.0
+        return max(0.05, 1.0 - (usage - 0.5) * 2)
+
+@dataclass
+class RouteMetrics:
+    """Track metrics of a route template"""
+    requests: int = 0
+    rate_limited: int = 0
+    server_errors: int = 0
+    # Time on the wire, from issuing the request to its response
+    latency: LatencyHistogram = field(default_factory=LatencyHistogram)
+    # Time spent queued behind rate limits before being issued
+    wait: LatencyHistogram = field(default_factory=LatencyHistogram)
 
 @dataclass
 class RequestMetrics:
@@ -52,7 +229,124 @@ class RequestMetrics:
     failed_requests: int = 0
     retry_attempts: int = 0
     last_reset: float = field(default_factory=time.time)
-    request_times: deque = field(default_factory=lambda: deque(maxlen=100))
+    latency: LatencyHistogram = field(default_factory=LatencyHistogram)
+    wait: LatencyHistogram = field(default_factory=LatencyHistogram)
+    routes: Dict[str, RouteMetrics] = field(default_factory=dict)
+    max_routes: int = 500
+    
+    def route(self, route: str) -> RouteMetrics:
+        """Get the metrics of a route, routes past `max_routes` are tracked together"""
+        metrics = self.routes.get(route)
+        if metrics is None:
+            if len(self.routes) >= self.max_routes:
+                route = 'other'
+            metrics = self.routes.setdefault(route, RouteMetrics())
+        return metrics
+
+@dataclass
+class CoalescedMessage:
+    """Texts and embeds waiting to be sent together in a channel"""
+    contents: list = field(default_factory=list)
+    embeds: list = field(default_factory=list)
+    futures: list = field(default_factory=list)
+    length: int = 0
+    embeds_length: int = 0
+    task: Optional[asyncio.Task] = None
+    
+    # Discord limits of a single message
+    max_length: ClassVar[int] = 2000
+    max_embeds: ClassVar[int] = 10
+    max_embeds_length: ClassVar[int] = 6000
+    
+    def fits(self, content: Optional[str], embed: Optional[discord.Embed]) -> bool:
+        if content:
+            # Texts are joined by a new line
+            length = self.length + len(content) + (1 if self.contents else 0)
+            if length > self.max_length:
+                return False
+        if embed is not None:
+            if len(self.embeds) >= self.max_embeds or self.embeds_length + len(embed) > self.max_embeds_length:
+                return False
+        return True
+    
+    def add(self, content: Optional[str], embed: Optional[discord.Embed], future: asyncio.Future) -> None:
+        if content:
+            self.length += len(content) + (1 if self.contents else 0)
+            self.contents.append(content)
+        if embed is not None:
+            self.embeds_length += len(embed)
+            self.embeds.append(embed)
+        self.futures.append(future)
+
+class MessageCoalescer:
+    """
+    Merge the texts and embeds sent in a channel within a short window into as few messages as possible.
+    A batch is sent `window` seconds after its first message, and never before the previous batch of the
+    same channel is sent, so messages keep piling up in the next batch while a channel is rate limited.
+    Every caller gets the message its content ended up in.
+    """
+    
+    def __init__(self, limiter: "DiscordRateLimiter", window: float = 0.5):
+        self.limiter = limiter
+        self.window = window
+        self.messages: int = 0
+        self.sent: int = 0
+        # Channel ID -> batch still accepting messages
+        self._open: Dict[int, CoalescedMessage] = {}
+        # Channel ID -> task of the last batch, the next one waits for it
+        self._last_tasks: Dict[int, asyncio.Task] = {}
+    
+    async def send(self, channel: discord.abc.Messageable, content: Optional[str] = None, embed: Optional[discord.Embed] = None) -> Optional[discord.Message]:
+        future = asyncio.get_running_loop().create_future()
+        batch = self._open.get(channel.id)
+        if batch is not None and not batch.fits(content, embed):
+            # Full, it is left to its task and the message starts the next batch
+            del self._open[channel.id]
+            batch = None
+        if batch is None:
+            batch = self._open[channel.id] = CoalescedMessage()
+            previous = self._last_tasks.get(channel.id)
+            batch.task = asyncio.create_task(self._send_batch(channel, batch, previous), name=f"coalesce:{channel.id}")
+            self._last_tasks[channel.id] = batch.task
+            batch.task.add_done_callback(lambda task, channel_id=channel.id, batch=batch: self._batch_done(channel_id, batch, task))
+        batch.add(content, embed, future)
+        self.messages += 1
+        return await future
+    
+    def _batch_done(self, channel_id: int, batch: CoalescedMessage, task: asyncio.Task) -> None:
+        # Resolved here rather than in the task, which may be cancelled before it even starts
+        if self._last_tasks.get(channel_id) is task:
+            del self._last_tasks[channel_id]
+        if self._open.get(channel_id) is batch:
+            del self._open[channel_id]
+        for future in batch.futures:
+            if future.done():
+                continue
+            if task.cancelled():
+                future.cancel()
+            elif task.exception() is not None:
+                future.set_exception(task.exception())
+            else:
+                future.set_result(task.result())
+    
+    async def _send_batch(self, channel: discord.abc.Messageable, batch: CoalescedMessage, previous: Optional[asyncio.Task]) -> Optional[discord.Message]:
+        await asyncio.sleep(self.window)
+        if previous is not None:
+            await asyncio.wait([previous])
+        if self._open.get(channel.id) is batch:
+            del self._open[channel.id]
+        kwargs = {}
+        if batch.embeds:
+            kwargs['embeds'] = batch.embeds
+        message = await self.limiter.safe_send(channel, "\n".join(batch.contents) or None, **kwargs)
+        self.sent += 1
+        return message
+    
+    async def close(self) -> None:
+        """Wait for every pending batch to be sent"""
+        tasks = list(self._last_tasks.values())
+        if tasks:
+            await asyncio.wait(tasks)
 
 class DiscordRateLimiter:
     """
@@ -60,11 +354,27 @@ class DiscordRateLimiter:
     with headers, buckets, global limits, and sharding support.
     """
     
-    def __init__(self, session: Optional[aiohttp.ClientSession] = None):
+    def __init__(
+        self,
+        session: Optional[aiohttp.ClientSession] = None,
+        proactive: bool = True,
+        global_rate: float = 50.0,
+        invalid_request_threshold: int = 10000,
+        max_buckets: int = 10000,
+        bucket_ttl: float = 300.0,
+        cleanup_interval: float = 60.0,
+        coalesce_window: float = 0.5
+    ):
         self.session = session
-        self.buckets: Dict[str, RateLimitBucket] = {}
-        self.global_limit = GlobalRateLimit()
+        self.proactive = proactive
+        self.buckets = BucketStore(max_size=max_buckets, ttl=bucket_ttl)
+        # Route -> Discord bucket hash (x-ratelimit-bucket), routes sharing a hash share their limits
+        self.route_buckets: OrderedDict[str, str] = OrderedDict()
+        self.cleanup_interval = cleanup_interval
+        self.global_limit = GlobalRateLimit(rate=global_rate, tokens=global_rate)
+        self.invalid_requests = InvalidRequestTracker(threshold=invalid_request_threshold)
         self.metrics = RequestMetrics()
+        self.coalescer = MessageCoalescer(self, window=coalesce_window)
         
         # Route-specific configurations
         self.route_configs = {
@@ -75,25 +385,33 @@ class DiscordRateLimiter:
             'reactions': {'default_limit': 1, 'window': 1.0},
         }
         
-        # Thread-safe locks
-        self._bucket_locks: Dict[str, asyncio.Lock] = defaultdict(asyncio.Lock)
+        # Per-route FIFO queues, each drained by its own worker task
+        self._queues: Dict[str, deque] = {}
+        self._workers: Dict[str, asyncio.Task] = {}
+        self._in_flight: set = set()
         self._global_lock = asyncio.Lock()
         
-        # Shard-specific handling
-        self.shard_buckets: Dict[int, Dict[str, RateLimitBucket]] = defaultdict(dict)
+        # Background task evicting expired buckets, started with the first request
+        self._janitor: Optional[asyncio.Task] = None
         
     def _get_bucket_key(self, route: str, major_params: Dict[str, Any] = None, shard_id: int = None) -> str:
-        """Generate bucket key from route and major parameters"""
+        """
+        Generate bucket key from the route template (e.g. `POST /channels/{channel_id}/messages`)
+        and its major parameter, so every request on the same resource shares the same key.
+        """
+        major_id = None
         if major_params:
-            # Sort for consistent hashing
-            param_str = ''.join(f"{k}:{v}" for k, v in sorted(major_params.items()))
-            route_hash = hashlib.md5(f"{route}:{param_str}".encode()).hexdigest()[:16]
-        else:
-            route_hash = hashlib.md5(route.encode()).hexdigest()[:16]
-            
-        if shard_id is not None:
-            return f"shard_{shard_id}:{route_hash}"
-        return route_hash
+            for param in MAJOR_PARAMETERS:
+                if param in major_params:
+                    major_id = major_params[param]
+                    break
+            else:
+                major_id = '-'.join(str(value) for _, value in sorted(major_params.items()))
+        return _make_bucket_key(route, major_id, shard_id)
+    
+    def _resolve_bucket_key(self, route: str, major_params: Dict[str, Any] = None, shard_id: int = None) -> str:
+        """Generate bucket key, using Discord's bucket hash in place of the route once it is known"""
+        return self._get_bucket_key(self.route_buckets.get(route, route), major_params, shard_id)
     
     def _parse_rate_limit_headers(self, headers: dict) -> Tuple[Optional[RateLimitBucket], bool]:
         """Parse Discord rate limit headers"""
@@ -115,12 +433,78 @@ class DiscordRateLimiter:
                 reset_at=float(headers.get('x-ratelimit-reset', 0)),
                 bucket_hash=headers.get('x-ratelimit-bucket')
             )
+            bucket.window_end = time.time() + bucket.reset_after
             
             if bucket.remaining == 0:
-                bucket.locked_until = time.time() + bucket.reset_after
+                bucket.locked_until = bucket.window_end
                 
         return bucket, is_global
     
+    def update_from_headers(self, route: str, headers, major_params: Dict[str, Any] = None, shard_id: int = None) -> None:
+        """Update bucket state from the rate limit headers of any response"""
+        if not self.proactive:
+            return
+            
+        bucket_hash = headers.get('x-ratelimit-bucket')
+        if bucket_hash and self.route_buckets.get(route) != bucket_hash:
+            self.route_buckets[route] = bucket_hash
+            if len(self.route_buckets) > self.buckets.max_size:
+                # Oldest mapping, it will be learnt again from the next response of that route
+                self.route_buckets.popitem(last=False)
+            
+        bucket, _ = self._parse_rate_limit_headers(headers)
+        if bucket:
+            bucket_key = self._resolve_bucket_key(route, major_params, shard_id)
+            current = self.buckets.get(bucket_key)
+            if current and current.reset_at == bucket.reset_at and current.remaining < bucket.remaining:
+                # Same window, other requests were dispatched since this one was answered
+                bucket.remaining = current.remaining
+                bucket.locked_until = current.locked_until
+            self.buckets[bucket_key] = bucket
+    
+    def trace_config(self) -> aiohttp.TraceConfig:
+        """
+        Build an aiohttp trace config feeding every response back into the limiter.
+        Pass it to the bot with `commands.Bot(..., http_trace=limiter.trace_config())`.
+        """
+        trace = aiohttp.TraceConfig()
+        trace.on_request_start.append(self._on_request_start)
+        trace.on_request_end.append(self._on_request_end)
+        return trace
+    
+    @property
+    def global_rate(self) -> float:
+        """Current global requests per second, lowered as the invalid request budget runs out"""
+        return self.global_limit.rate * self.invalid_requests.throttle_factor
+    
+    async def _acquire_global_token(self) -> None:
+        """Wait for a token of the global bucket"""
+        while True:
+            delay = self.global_limit.take(self.global_rate)
+            if delay <= 0:
+                return
+            await asyncio.sleep(delay)
+    
+    async def _on_request_start(self, session: aiohttp.ClientSession, trace_config_ctx, params: aiohttp.TraceRequestStartParams) -> None:
+        """aiohttp hook called before a request is sent"""
+        if _current_request.get() is None:
+            # Issued directly by discord.py, it can't be delayed but still counts toward the global limit
+            self.global_limit.consume(self.global_rate)
+    
+    async def _on_request_end(self, session: aiohttp.ClientSession, trace_config_ctx, params: aiohttp.TraceRequestEndParams) -> None:
+        """aiohttp hook called once the response headers of a request are received"""
+        response = params.response
+        if response.status in (401, 403) or (response.status == 429 and response.headers.get('x-ratelimit-scope') != 'shared'):
+            # Shared scope 429s are not counted by Cloudflare
+            self.invalid_requests.record()
+            
+        request = _current_request.get()
+        if request is None:
+            # Request not issued through the limiter, we can't tell its route
+            return
+        route, major_params, shard_id = request
+        self.update_from_headers(route, params.response.headers, major_params, shard_id)
+    
     async def _wait_for_rate_limit(self, bucket_key: str, shard_id: int = None) -> None:
         """Wait for rate limit to expire"""
         bucket = self.buckets.get(bucket_key)
@@ -130,80 +514,172 @@ class DiscordRateLimiter:
             logger.warning(f"Global rate limit hit, waiting {wait_time:.2f}s")
             await asyncio.sleep(wait_time)
             
-        if bucket and bucket.is_rate_limited:
+        while bucket and bucket.is_rate_limited:
             wait_time = bucket.retry_after
-            logger.warning(f"Bucket {bucket_key} rate limited, waiting {wait_time:.2f}s")
+            logger.debug(f"Bucket {bucket_key} exhausted, waiting {wait_time:.2f}s")
             await asyncio.sleep(wait_time)
+            # The bucket may have been replaced or locked again by a response meanwhile
+            bucket = self.buckets.get(bucket_key)
+    
+    async def _submit(self, request: Callable[[], Awaitable[Any]], route: str, major_params: Dict[str, Any] = None, shard_id: int = None, queued_at: float = None) -> Any:
+        """
+        Queue a request behind the previous ones of the same route and wait for its result.
+        Retries give the time their previous attempt failed, so their wait includes the backoff.
+        """
+        self._ensure_janitor()
+        queue_key = self._get_bucket_key(route, major_params, shard_id)
+        future = asyncio.get_running_loop().create_future()
+        
+        queue = self._queues.get(queue_key)
+        if queue is None:
+            queue = self._queues[queue_key] = deque()
+        item = QueuedRequest(request, route, major_params, shard_id, future)
+        if queued_at is not None:
+            item.queued_at = queued_at
+        queue.append(item)
+        
+        if queue_key not in self._workers:
+            self._workers[queue_key] = asyncio.create_task(
+                self._bucket_worker(queue_key, queue), name=f"rate-limiter:{queue_key}"
+            )
+        return await future
+    
+    async def _bucket_worker(self, queue_key: str, queue: deque) -> None:
+        """
+        Drain a route queue in order, issuing as many requests concurrently as the
+        bucket has remaining calls and parking until reset once it is exhausted.
+        """
+        try:
+            while queue:
+                item: QueuedRequest = queue[0]
+                if item.future.done():
+                    # Caller gave up waiting (cancelled)
+                    queue.popleft()
+                    continue
+                    
+                bucket_key = self._resolve_bucket_key(item.route, item.major_params, item.shard_id)
+                await self._wait_for_rate_limit(bucket_key, item.shard_id)
+                await self._acquire_global_token()
+                queue.popleft()
+                if item.future.done():
+                    continue
+                
+                bucket = self.buckets.get(bucket_key)
+                if bucket is None or bucket.limit <= 0:
+                    # Unknown bucket: one request at a time until headers tell us its limit
+                    await self._run_request(item)
+                else:
+                    bucket.consume()
+                    task = asyncio.create_task(self._run_request(item))
+                    self._in_flight.add(task)
+                    task.add_done_callback(self._in_flight.discard)
+        finally:
+            # No await between the empty check and the removal, so no request can be left behind
+            del self._workers[queue_key]
+            if self._queues.get(queue_key) is queue:
+                del self._queues[queue_key]
+            for item in queue:
+                item.future.cancel()
+    
+    async def _run_request(self, item: QueuedRequest) -> None:
+        """Issue a queued request and forward its outcome to the waiting caller"""
+        start_time = time.time()
+        route_metrics = self.metrics.route(item.route)
+        self.metrics.total_requests += 1
+        route_metrics.requests += 1
+        wait_time = start_time - item.queued_at
+        self.metrics.wait.record(wait_time)
+        route_metrics.wait.record(wait_time)
+        token = _current_request.set((item.route, item.major_params, item.shard_id))
+        try:
+            result = await item.request()
+        except asyncio.CancelledError:
+            item.future.cancel()
+            raise
+        except Exception as e:
+            if not item.future.done():
+                item.future.set_exception(e)
+        else:
+            if not item.future.done():
+                item.future.set_result(result)
+        finally:
+            _current_request.reset(token)
+            request_time = time.time() - start_time
+            self.metrics.latency.record(request_time)
+            route_metrics.latency.record(request_time)
     
     async def execute_request(
         self,
-        coro: Callable,
+        request: Union[Callable[[], Awaitable[Any]], Awaitable[Any]],
         route: str,
         major_params: Dict[str, Any] = None,
         max_retries: int = 5,
         shard_id: int = None,
         **kwargs
     ) -> Any:
-        """Execute a Discord API request with proper rate limiting"""
-        bucket_key = self._get_bucket_key(route, major_params, shard_id)
-        
+        """
+        Execute a Discord API request with proper rate limiting.
+        `request` should be a factory returning a fresh awaitable (e.g. `lambda: channel.send("Hello")`)
+        so the request can be issued again on retries. A bare awaitable is still accepted but can't be retried.
+        """
+        if not callable(request):
+            # An awaitable can only be awaited once, retrying it would raise a RuntimeError
+            awaitable, request = request, (lambda: awaitable)
+            max_retries = 0
+            
+        # The wait of a retry counts from the failure of the previous attempt, backoff included
+        queued_at = None
         for attempt in range(max_retries + 1):
             try:
-                # Wait for rate limits
-                await self._wait_for_rate_limit(bucket_key, shard_id)
+                if attempt > 0:
+                    self.metrics.retry_attempts += 1
+                    
+                return await self._submit(request, route, major_params, shard_id, queued_at)
                 
-                async with self._bucket_locks[bucket_key]:
-                    start_time = time.time()
-                    self.metrics.total_requests += 1
+            except discord.HTTPException as e:
+                if e.status == 429:  # Rate limited
+                    self.metrics.rate_limited_requests += 1
+                    self.metrics.route(route).rate_limited += 1
                     
-                    try:
-                        if attempt > 0:
-                            self.metrics.retry_attempts += 1
-                            
-                        result = await coro
-                        
-                        # Record successful request time
-                        request_time = time.time() - start_time
-                        self.metrics.request_times.append(request_time)
-                        
-                        return result
+                    # Parse rate limit headers from the exception
+                    if hasattr(e, 'response') and hasattr(e.response, 'headers'):
+                        bucket, is_global = self._parse_rate_limit_headers(e.response.headers)
                         
-                    except discord.HTTPException as e:
-                        request_time = time.time() - start_time
-                        self.metrics.request_times.append(request_time)
-                        
-                        if e.status == 429:  # Rate limited
-                            self.metrics.rate_limited_requests += 1
+                        if is_global:
+                            retry_after = self.global_limit.retry_after
+                        elif bucket:
+                            self.buckets[self._resolve_bucket_key(route, major_params, shard_id)] = bucket
+                            retry_after = bucket.reset_after
+                        else:
+                            retry_after = 5.0  # Fallback
+                            
+                        if attempt < max_retries:
+                            wait_time = retry_after + (attempt * 0.5)  # Exponential backoff
+                            logger.warning(f"Rate limited on {route}, waiting {wait_time:.2f}s (attempt {attempt + 1})")
+                            queued_at = time.time()
+                            await asyncio.sleep(wait_time)
+                            continue
                             
-                            # Parse rate limit headers from the exception
-                            if hasattr(e, 'response') and hasattr(e.response, 'headers'):
-                                bucket, is_global = self._parse_rate_limit_headers(e.response.headers)
-                                
-                                if is_global:
-                                    retry_after = self.global_limit.retry_after
-                                elif bucket:
-                                    self.buckets[bucket_key] = bucket
-                                    retry_after = bucket.reset_after
-                                else:
-                                    retry_after = 5.0  # Fallback
-                                    
-                                if attempt < max_retries:
-                                    wait_time = retry_after + (attempt * 0.5)  # Exponential backoff
-                                    logger.warning(f"Rate limited on {route}, waiting {wait_time:.2f}s (attempt {attempt + 1})")
-                                    await asyncio.sleep(wait_time)
-                                    continue
-                                    
-                        elif e.status == 502 or e.status == 503 or e.status == 504:  # Server errors
-                            if attempt < max_retries:
-                                wait_time = (2 ** attempt) + (attempt * 0.1)  # Exponential backoff
-                                logger.warning(f"Server error {e.status} on {route}, retrying in {wait_time:.2f}s")
-                                await asyncio.sleep(wait_time)
-                                continue
-                                
-                        # Re-raise if not retryable or max retries reached
-                        self.metrics.failed_requests += 1
-                        raise
+                elif e.status == 502 or e.status == 503 or e.status == 504:  # Server errors
+                    self.metrics.route(route).server_errors += 1
+                    if attempt < max_retries:
+                        wait_time = (2 ** attempt) + (attempt * 0.1)  # Exponential backoff
+                        logger.warning(f"Server error {e.status} on {route}, retrying in {wait_time:.2f}s")
+                        queued_at = time.time()
+                        await asyncio.sleep(wait_time)
+                        continue
                         
+                elif e.status >= 500:
+                    self.metrics.route(route).server_errors += 1
+                    
+                # Re-raise if not retryable or max retries reached
+                self.metrics.failed_requests += 1
+                raise
+                
+            except discord.DiscordException:
+                # Discord errors are already handled above, others (Forbidden, NotFound,
+                # InteractionResponded...) would fail the same way if issued again
+                raise
             except Exception as e:
                 if attempt == max_retries:
                     self.metrics.failed_requests += 1
@@ -213,6 +689,7 @@ class DiscordRateLimiter:
                 # Exponential backoff for unexpected errors
                 wait_time = (2 ** attempt) + (attempt * 0.1)
                 logger.warning(f"Unexpected error on {route}, retrying in {wait_time:.2f}s: {e}")
+                queued_at = time.time()
                 await asyncio.sleep(wait_time)
                 
         raise RuntimeError(f"Failed to execute request after {max_retries} retries")
@@ -220,88 +697,92 @@ class DiscordRateLimiter:
     async def safe_send(self, channel: discord.TextChannel, *args, **kwargs) -> Optional[discord.Message]:
         """Safe channel.send() with rate limiting"""
         return await self.execute_request(
-            channel.send(*args, **kwargs),
-            route=f'POST /channels/{channel.id}/messages',
+            lambda: channel.send(*args, **kwargs),
+            route='POST /channels/{channel_id}/messages',
             major_params={'channel_id': channel.id}
         )
     
+    async def safe_send_coalesced(self, channel: discord.abc.Messageable, content: Optional[str] = None, embed: Optional[discord.Embed] = None) -> Optional[discord.Message]:
+        """safe_send() merging the text and embed with the others sent in the channel within a short window"""
+        return await self.coalescer.send(channel, content, embed)
+    
     async def safe_edit(self, message: discord.Message, *args, **kwargs) -> Optional[discord.Message]:
         """Safe message.edit() with rate limiting"""
         return await self.execute_request(
-            message.edit(*args, **kwargs),
-            route=f'PATCH /channels/{message.channel.id}/messages/{message.id}',
+            lambda: message.edit(*args, **kwargs),
+            route='PATCH /channels/{channel_id}/messages/{message_id}',
             major_params={'channel_id': message.channel.id}
         )
     
     async def safe_delete(self, message: discord.Message) -> None:
         """Safe message.delete() with rate limiting"""
         return await self.execute_request(
-            message.delete(),
-            route=f'DELETE /channels/{message.channel.id}/messages/{message.id}',
+            lambda: message.delete(),
+            route='DELETE /channels/{channel_id}/messages/{message_id}',
             major_params={'channel_id': message.channel.id}
         )
     
     async def safe_channel_create(self, guild: discord.Guild, *args, **kwargs) -> Optional[discord.TextChannel]:
         """Safe guild.create_text_channel() with rate limiting"""
         return await self.execute_request(
-            guild.create_text_channel(*args, **kwargs),
-            route=f'POST /guilds/{guild.id}/channels',
+            lambda: guild.create_text_channel(*args, **kwargs),
+            route='POST /guilds/{guild_id}/channels',
             major_params={'guild_id': guild.id}
         )
     
     async def safe_channel_delete(self, channel: Union[discord.TextChannel, discord.VoiceChannel]) -> None:
         """Safe channel.delete() with rate limiting"""
         return await self.execute_request(
-            channel.delete(),
-            route=f'DELETE /channels/{channel.id}',
+            lambda: channel.delete(),
+            route='DELETE /channels/{channel_id}',
             major_params={'channel_id': channel.id}
         )
     
     async def safe_channel_edit(self, channel: Union[discord.TextChannel, discord.VoiceChannel], *args, **kwargs) -> Optional[Union[discord.TextChannel, discord.VoiceChannel]]:
         """Safe channel.edit() with rate limiting"""
         return await self.execute_request(
-            channel.edit(*args, **kwargs),
-            route=f'PATCH /channels/{channel.id}',
+            lambda: channel.edit(*args, **kwargs),
+            route='PATCH /channels/{channel_id}',
             major_params={'channel_id': channel.id}
         )
     
     async def safe_add_reaction(self, message: discord.Message, emoji: Union[str, discord.Emoji]) -> None:
         """Safe message.add_reaction() with rate limiting"""
         return await self.execute_request(
-            message.add_reaction(emoji),
-            route=f'PUT /channels/{message.channel.id}/messages/{message.id}/reactions',
+            lambda: message.add_reaction(emoji),
+            route='PUT /channels/{channel_id}/messages/{message_id}/reactions/{emoji}/@me',
             major_params={'channel_id': message.channel.id}
         )
     
     async def safe_member_edit(self, member: discord.Member, *args, **kwargs) -> None:
         """Safe member.edit() with rate limiting"""
         return await self.execute_request(
-            member.edit(*args, **kwargs),
-            route=f'PATCH /guilds/{member.guild.id}/members/{member.id}',
+            lambda: member.edit(*args, **kwargs),
+            route='PATCH /guilds/{guild_id}/members/{user_id}',
             major_params={'guild_id': member.guild.id}
         )
     
     async def safe_ban(self, guild: discord.Guild, user: Union[discord.User, discord.Member], *args, **kwargs) -> None:
         """Safe guild.ban() with rate limiting"""
         return await self.execute_request(
-            guild.ban(user, *args, **kwargs),
-            route=f'PUT /guilds/{guild.id}/bans/{user.id}',
+            lambda: guild.ban(user, *args, **kwargs),
+            route='PUT /guilds/{guild_id}/bans/{user_id}',
             major_params={'guild_id': guild.id}
         )
     
     async def safe_unban(self, guild: discord.Guild, user: discord.User) -> None:
         """Safe guild.unban() with rate limiting"""
         return await self.execute_request(
-            guild.unban(user),
-            route=f'DELETE /guilds/{guild.id}/bans/{user.id}',
+            lambda: guild.unban(user),
+            route='DELETE /guilds/{guild_id}/bans/{user_id}',
             major_params={'guild_id': guild.id}
         )
     
     async def safe_kick(self, member: discord.Member, *args, **kwargs) -> None:
         """Safe member.kick() with rate limiting"""
         return await self.execute_request(
-            member.kick(*args, **kwargs),
-            route=f'DELETE /guilds/{member.guild.id}/members/{member.id}',
+            lambda: member.kick(*args, **kwargs),
+            route='DELETE /guilds/{guild_id}/members/{user_id}',
             major_params={'guild_id': member.guild.id}
         )
     
@@ -310,10 +791,6 @@ class DiscordRateLimiter:
         current_time = time.time()
         uptime = current_time - self.metrics.last_reset
         
-        avg_request_time = 0
-        if self.metrics.request_times:
-            avg_request_time = sum(self.metrics.request_times) / len(self.metrics.request_times)
-        
         rate_limit_percentage = 0
         if self.metrics.total_requests > 0:
             rate_limit_percentage = (self.metrics.rate_limited_requests / self.metrics.total_requests) * 100
@@ -324,11 +801,35 @@ class DiscordRateLimiter:
             'failed_requests': self.metrics.failed_requests,
             'retry_attempts': self.metrics.retry_attempts,
             'rate_limit_percentage': round(rate_limit_percentage, 2),
-            'average_request_time': round(avg_request_time, 3),
+            'average_request_time': round(self.metrics.latency.average, 3),
+            'p50_request_time': round(self.metrics.latency.percentile(50), 3),
+            'p95_request_time': round(self.metrics.latency.percentile(95), 3),
+            'p99_request_time': round(self.metrics.latency.percentile(99), 3),
+            'average_wait_time': round(self.metrics.wait.average, 3),
+            'p99_wait_time': round(self.metrics.wait.percentile(99), 3),
             'uptime_seconds': round(uptime, 2),
             'requests_per_minute': round((self.metrics.total_requests / uptime) * 60, 2) if uptime > 0 else 0,
             'active_buckets': len(self.buckets),
-            'global_rate_limited': self.global_limit.is_rate_limited
+            'global_rate_limited': self.global_limit.is_rate_limited,
+            'global_rate': round(self.global_rate, 2),
+            'invalid_requests': self.invalid_requests.count,
+            'routes': self.get_route_metrics()
+        }
+    
+    def get_route_metrics(self) -> Dict[str, Dict[str, Any]]:
+        """Get metrics of each route template"""
+        return {
+            route: {
+                'requests': metrics.requests,
+                'rate_limited': metrics.rate_limited,
+                'server_errors': metrics.server_errors,
+                'p50_request_time': round(metrics.latency.percentile(50), 3),
+                'p95_request_time': round(metrics.latency.percentile(95), 3),
+                'p99_request_time': round(metrics.latency.percentile(99), 3),
+                'average_wait_time': round(metrics.wait.average, 3),
+                'p99_wait_time': round(metrics.wait.percentile(99), 3),
+            }
+            for route, metrics in self.metrics.routes.items()
         }
     
     def reset_metrics(self):
@@ -337,18 +838,29 @@ class DiscordRateLimiter:
     
     async def cleanup_expired_buckets(self):
         """Clean up expired rate limit buckets"""
-        current_time = time.time()
-        expired_buckets = [
-            key for key, bucket in self.buckets.items()
-            if not bucket.is_rate_limited and (current_time - bucket.reset_at) > 300  # 5 minutes
-        ]
-        
-        for key in expired_buckets:
-            del self.buckets[key]
-            if key in self._bucket_locks:
-                del self._bucket_locks[key]
-        
-        logger.debug(f"Cleaned up {len(expired_buckets)} expired buckets")
+        expired_count = self.buckets.evict_expired()
+        logger.debug(f"Cleaned up {expired_count} expired buckets")
+    
+    def _ensure_janitor(self) -> None:
+        """Start the background cleanup task if it is not running"""
+        if self._janitor is None or self._janitor.done():
+            self._janitor = asyncio.create_task(self._janitor_loop(), name="rate-limiter:janitor")
+    
+    async def _janitor_loop(self) -> None:
+        """Periodically evict expired buckets"""
+        while True:
+            await asyncio.sleep(self.cleanup_interval)
+            try:
+                await self.cleanup_expired_buckets()
+            except Exception as e:
+                logger.error(f"Failed to clean up expired buckets: {e}")
+    
+    async def close(self) -> None:
+        """Send pending coalesced messages and stop the background cleanup task"""
+        await self.coalescer.close()
+        if self._janitor is not None:
+            self._janitor.cancel()
+            self._janitor = None
 
 # Global rate limiter instance
 _global_rate_limiter = None
@@ -366,28 +878,27 @@ def set_rate_limiter(rate_limiter: DiscordRateLimiter):
     _global_rate_limiter = rate_limiter
 
 # Convenience functions for easy integration
-async def safe_api_call(coro, route: str = None, major_params: Dict[str, Any] = None, **kwargs):
+async def safe_api_call(request, route: str = None, major_params: Dict[str, Any] = None, **kwargs):
     """
     Convenience function for backward compatibility and easy integration
     
     Usage:
-    await safe_api_call(channel.send("Hello"), route="POST /channels/{channel_id}/messages")
+    await safe_api_call(lambda: channel.send("Hello"), route="POST /channels/{channel_id}/messages")
     """
     limiter = get_rate_limiter()
     
     if route:
-        return await limiter.execute_request(coro, route, major_params, **kwargs)
+        return await limiter.execute_request(request, route, major_params, **kwargs)
     else:
         # Fallback to simple execution with basic retry logic
-        return await limiter.execute_request(coro, "unknown", **kwargs)
+        return await limiter.execute_request(request, "unknown", **kwargs)
 
 # Decorators for easy integration
 def rate_limited(route: str = None, major_params: Dict[str, Any] = None):
     """Decorator to add rate limiting to async functions"""
     def decorator(func):
         async def wrapper(*args, **kwargs):
-            coro = func(*args, **kwargs)
-            return await safe_api_call(coro, route, major_params)
+            return await safe_api_call(lambda: func(*args, **kwargs), route, major_params)
         return wrapper
     return decorator
 
@@ -399,16 +910,16 @@ class RateLimitContext:
         self.limiter = get_rate_limiter()
     
     async def __aenter__(self):
-        bucket_key = self.limiter._get_bucket_key(self.route, self.major_params)
+        bucket_key = self.limiter._resolve_bucket_key(self.route, self.major_params)
         await self.limiter._wait_for_rate_limit(bucket_key)
         return self
     
     async def __aexit__(self, exc_type, exc_val, exc_tb):
         pass
     
-    async def execute(self, coro):
-        """Execute a coroutine within the rate limit context"""
-        return await self.limiter.execute_request(coro, self.route, self.major_params)
+    async def execute(self, request):
+        """Execute a request factory within the rate limit context"""
+        return await self.limiter.execute_request(request, self.route, self.major_params)
 
 class RateLimiterCog(commands.Cog):
     """Cog for rate limiter management commands"""
@@ -434,7 +945,11 @@ class RateLimiterCog(commands.Cog):
             embed.add_field(name="Req/min moyenne", value=metrics['requests_per_minute'], inline=True)
             embed.add_field(name="Buckets actifs", value=metrics['active_buckets'], inline=True)
             embed.add_field(name="Temps moyen", value=f"{metrics['average_request_time']}s", inline=True)
+            embed.add_field(name="Temps p95 / p99", value=f"{metrics['p95_request_time']}s / {metrics['p99_request_time']}s", inline=True)
+            embed.add_field(name="Attente moyenne", value=f"{metrics['average_wait_time']}s", inline=True)
             embed.add_field(name="Global rate limited", value="✅" if metrics['global_rate_limited'] else "❌", inline=True)
+            embed.add_field(name="Débit global", value=f"{metrics['global_rate']} req/s", inline=True)
+            embed.add_field(name="Requêtes invalides (10 min)", value=metrics['invalid_requests'], inline=True)
             
             await ctx.send(embed=embed)
         except Exception as e:
@@ -0,0 +1,144 @@
+# Copyright (c) 2025 Benoît Pelletier
+# SPDX-License-Identifier: MPL-2.0
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+import asyncio
+import time
+from collections import deque
+import traceback
+from typing import Any, Coroutine
+from dismob import log
+from dismob.histogram import LatencyHistogram
+
+class TaskSupervisor:
+    """
+    Runs the background tasks of a plugin, keeping a reference to each of them until done.
+    At most `max_concurrency` tasks run at the same time, the others wait their turn,
+    and no more than `max_pending` tasks (running or waiting) are accepted.
+    Exceptions are logged and tasks still pending are cancelled by `close`, to call in `cog_unload`.
+    """
+
+    def __init__(self, name: str, max_concurrency: int = 10, max_pending: int = 100):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.max_pending = max_pending
+        self.running: int = 0
+        self.completed: int = 0
+        self.failed: int = 0
+        self.rejected: int = 0
+        self.durations = LatencyHistogram()
+        # Coroutine of each pending task, to close it if the task is cancelled before starting
+        self._tasks: dict[asyncio.Task, Coroutine[Any, Any, Any]] = {}
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._waiters: deque[asyncio.Future] = deque()
+        self._closed: bool = False
+
+    @property
+    def pending(self) -> int:
+        """Tasks running or waiting to run"""
+        return len(self._tasks)
+
+    @property
+    def queued(self) -> int:
+        """Tasks waiting for a free slot"""
+        return len(self._tasks) - self.running
+
+    def spawn(self, coro: Coroutine[Any, Any, Any], name: str = "task") -> asyncio.Task | None:
+        """
+        Schedule the coroutine without waiting.
+
+        Returns:
+            The task, or None if the supervisor is full or closed, in which case the coroutine is discarded
+        """
+        if self._closed or len(self._tasks) >= self.max_pending:
+            self.rejected += 1
+            coro.close()
+            reason = "supervisor closed" if self._closed else f"{len(self._tasks)} tasks already pending"
+            log.warning(f"Task `{name}` of `{self.name}` rejected, {reason}")
+            return None
+        task = asyncio.create_task(self._run(coro), name=f"{self.name}:{name}")
+        self._tasks[task] = coro
+        task.add_done_callback(self._task_done)
+        return task
+
+    async def submit(self, coro: Coroutine[Any, Any, Any], name: str = "task") -> asyncio.Task | None:
+        """
+        Schedule the coroutine, waiting for room if the supervisor is full.
+
+        Returns:
+            The task, or None if the supervisor has been closed meanwhile
+        """
+        while not self._closed and len(self._tasks) >= self.max_pending:
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                coro.close()
+                raise
+            finally:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+        return self.spawn(coro, name)
+
+    async def _run(self, coro: Coroutine[Any, Any, Any]) -> Any:
+        async with self._semaphore:
+            self.running += 1
+            start = time.perf_counter()
+            try:
+                return await coro
+            finally:
+                self.running -= 1
+                self.durations.record(time.perf_counter() - start)
+
+    def _task_done(self, task: asyncio.Task) -> None:
+        coro = self._tasks.pop(task, None)
+        if task.cancelled():
+            if coro is not None:
+                coro.close()
+        elif task.exception() is not None:
+            self.failed += 1
+            log.error(f"Task `{task.get_name()}` failed:\n{''.join(traceback.format_exception(task.exception())).rstrip()}", stacktrace=False)
+        else:
+            self.completed += 1
+        self._wake_waiters(1)
+
+    def _wake_waiters(self, count: int) -> None:
+        while count > 0 and self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                count -= 1
+
+    async def close(self) -> None:
+        """Cancel pending tasks and wait for them, no task is accepted afterwards"""
+        self._closed = True
+        _supervisors.pop(self.name, None)
+        self._wake_waiters(len(self._waiters))
+        tasks = list(self._tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            'running': self.running,
+            'queued': self.queued,
+            'completed': self.completed,
+            'failed': self.failed,
+            'rejected': self.rejected,
+            'avg_duration': self.durations.average,
+            'p95_duration': self.durations.percentile(95)
+        }
+
+_supervisors: dict[str, TaskSupervisor] = {}
+
+def create_supervisor(name: str, max_concurrency: int = 10, max_pending: int = 100) -> TaskSupervisor:
+    """Create the task supervisor of a plugin, it is listed by `supervisors` until closed"""
+    supervisor = _supervisors[name] = TaskSupervisor(name, max_concurrency, max_pending)
+    return supervisor
+
+def supervisors() -> list[TaskSupervisor]:
+    return list(_supervisors.values())
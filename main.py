@@ -5,23 +5,41 @@
 # file, You can obtain one at https://mozilla.org/MPL/2.0/.
 
 import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Must be enabled before the other imports to time them
+from dismob import profiling
+if os.getenv('STARTUP_PROFILE', '').lower() in ('1', 'true', 'yes'):
+    profiling.enable(os.getenv('STARTUP_PROFILE_FILE', 'startup_profile.json'))
+
+import signal
 import discord
 from discord.ext import commands
-from dotenv import load_dotenv
-from dismob import log, filehelper, predicate, decorators
+from dismob import log, filehelper, predicate, decorators, extensions, database
+from dismob.rate_limiter import DiscordRateLimiter, get_rate_limiter, set_rate_limiter
 from dismob.helpcommand import MyHelpCommand
+from dismob.metrics import MetricsExporter
 from dismob.event import Event, BotEvents
 
-load_dotenv()
-
 log.setup_logger(
     logger_name=os.getenv('LOG_NAME', 'dismob'),
     file_level=os.getenv('LOG_FILE_LEVEL', 'INFO'),
-    console_level=os.getenv('LOG_CONSOLE_LEVEL', 'INFO')
+    console_level=os.getenv('LOG_CONSOLE_LEVEL', 'INFO'),
+    queue_size=int(os.getenv('LOG_QUEUE_SIZE', '10000')),
+    queue_policy=os.getenv('LOG_QUEUE_POLICY', 'drop'),
+    rotate_bytes=int(os.getenv('LOG_ROTATE_BYTES', '0')),
+    rotate_when=os.getenv('LOG_ROTATE_WHEN', ''),
+    backup_count=int(os.getenv('LOG_BACKUP_COUNT', '5')),
+    compress=os.getenv('LOG_COMPRESS', 'true').lower() in ('1', 'true', 'yes'),
+    file_format=os.getenv('LOG_FORMAT', 'text')
 )
 
 prefix: str = os.getenv('BOT_PREFIX', '!')
 
+set_rate_limiter(DiscordRateLimiter(global_rate=float(os.getenv('RATE_LIMIT_GLOBAL', '50'))))
+
 config = filehelper.openConfig()
 if not config.get("modules"):
     config["modules"] = list()
@@ -30,13 +48,56 @@ intents = discord.Intents.default()
 intents.members = True
 intents.message_content = True
 intents.moderation = True
-bot: commands.Bot = commands.Bot(command_prefix=prefix, intents=intents, help_command=MyHelpCommand())
+class Bot(commands.Bot):
+    async def close(self) -> None:
+        # Dependent modules first, discord.py would unload them in loading order, dependencies first
+        await extensions.unload_modules(self)
+        # Send pending coalesced messages while the HTTP session is still open
+        await get_rate_limiter().close()
+        await super().close()
+
+bot: commands.Bot = Bot(
+    command_prefix=prefix,
+    intents=intents,
+    help_command=MyHelpCommand(),
+    # Feed every API response headers to the rate limiter so it knows buckets before hitting a 429
+    http_trace=get_rate_limiter().trace_config()
+)
+
+# Optional local endpoint exposing internal metrics for scraping
+metrics_exporter: MetricsExporter = None
+if os.getenv('METRICS_PORT'):
+    metrics_exporter = MetricsExporter(bot, host=os.getenv('METRICS_HOST', '127.0.0.1'), port=int(os.getenv('METRICS_PORT')))
 
 @bot.event
-async def on_ready() -> None:
+async def setup_hook() -> None:
+    """Runs once, after login but before connecting to the gateway, so commands are there as soon as the bot is online"""
     log.info(f"Discord.py version: `{discord.__version__}`")
+
+    if metrics_exporter is not None:
+        try:
+            await metrics_exporter.start()
+        except Exception as e:
+            log.error(f"Failed to start metrics exporter: `{e}`")
+
+    # Independent modules are loaded concurrently, after their dependencies
+    with profiling.phase("startup", "load modules"):
+        results = await extensions.load_modules(bot, config["modules"])
+    for module, error in results.items():
+        if error is None:
+            log.info(f"Module `{module}` successfully loaded.")
+        else:
+            log.error(f"Failed to load module `{module}`: {error}")
+
+first_ready: bool = True
+
+@bot.event
+async def on_ready() -> None:
+    """Runs on the first connection and again on every reconnection that could not resume the session"""
+    global first_ready
     log.info(f"Logged in as `{bot.user}`")
 
+    # A new session starts with the default presence
     status: str = config.get("status")
     if status is not None:
         try:
@@ -45,18 +106,40 @@ async def on_ready() -> None:
         except Exception as e:
             log.error(f"Failed to set bot status: `{e}`")
 
-    for module in config["modules"]:
-        try:
-            await bot.load_extension(f"plugins.{module}.main")
-            log.info(f"Module `{module}` successfully loaded.")
-        except Exception as e:
-            log.error(f"Failed to load module `{module}`: {e}")
-    BotEvents.on_ready.dispatch(bot)
-    log.info(f"Bot is ready.")
+    if first_ready:
+        first_ready = False
+        BotEvents.on_ready.dispatch(bot)
+        log.info(f"Bot is ready.")
+        profiling.report()
+    else:
+        log.info(f"Bot reconnected.")
+
+@bot.event
+async def on_resumed() -> None:
+    # The session, and so the presence, are kept on resume
+    log.info(f"Bot session resumed.")
+
+def save_config() -> None:
+    """
+    Persist the config after a change. Writes are coalesced by filehelper and done
+    off the event loop, so a crash only loses the last second of changes.
+    """
+    filehelper.saveConfig(config)
 
 def cleanup() -> None:
     log.info(f"Final cleanup")
     filehelper.saveConfig(config)
+    # Write any save still waiting for its debounce delay
+    filehelper.flush()
+
+def on_terminate(signum, frame) -> None:
+    """Persist the config right away on SIGTERM, then stop the bot like a Ctrl+C would"""
+    log.info("Received SIGTERM, shutting down...")
+    filehelper.saveConfig(config)
+    filehelper.flush()
+    raise KeyboardInterrupt
+
+signal.signal(signal.SIGTERM, on_terminate)
 
 # Handles errors that occur during command execution.
 @bot.event
@@ -120,7 +203,9 @@ async def set_bot_status(status: str):
 @decorators.suppress_command
 async def sync(ctx: commands.Context) -> None:
     log.info("Syncing slash commands")
-    await bot.tree.sync()
+    with profiling.phase("sync", "tree.sync"):
+        await bot.tree.sync()
+    profiling.dump()
     await log.success(ctx, "Slash commands synced successfully!\n*It may take some times to propagate to all guilds...*")
     
 @bot.command(description="Shutdown gracefully the bot")
@@ -129,7 +214,11 @@ async def sync(ctx: commands.Context) -> None:
 async def shutdown(interaction: discord.Interaction) -> None:
     log.info("Shutting down bot...")
     await log.client(interaction, "Shutting down bot...")
+    if metrics_exporter is not None:
+        await metrics_exporter.stop()
     await bot.close()
+    # Modules close their databases when unloaded, this catches any left open
+    await database.close_all()
     log.info("Bot has been shut off.")
 
 @bot.command(name="nick", aliases=["name"], description="Change the bot's nickname in this server")
@@ -157,6 +246,7 @@ async def set_status(ctx: commands.Context, status: str):
     try:
         await set_bot_status(status)
         config["status"] = status
+        save_config()
         await log.success(ctx, f"Bot status changed to `{status}`.")
     except Exception as e:
         await log.failure(ctx, f"Failed to change status: `{e}`")
@@ -233,6 +323,7 @@ async def loadModules(ctx: commands.Context, *args: str) -> None:
         except Exception as e:
             result += f":x: Failed to load module `{arg}`: `{e}`\n"
             log.error(f"Failed to load module `{arg}`: {e}")
+    save_config()
     await log.client(ctx, result)
 
 @modules.command(name="unload", aliases=["u", "disable", "deactivate"])
@@ -258,6 +349,7 @@ async def unloadModules(ctx: commands.Context, *args: str) -> None:
         except Exception as e:
             result += f":x: Failed to unload module `{arg}`: `{e}`\n"
             log.error(f"Failed to unload module `{arg}`: {e}")
+    save_config()
     await log.client(ctx, result)
 
 @modules.command(name="reload", aliases=["rl", "r"])
@@ -4,15 +4,20 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at https://mozilla.org/MPL/2.0/.
 
-import asyncio
-import aiosqlite
 import discord
 from discord.ext import commands
 from dismob import log
+from dismob.batcher import WriteBatcher
+from dismob.cache import GuildSettingsCache
+from dismob.database import open_database
 from dismob.event import BotEvents
+from dismob.tasks import create_supervisor
 from plugins.welcome.main import Welcome
 from plugins.levels.main import LevelSystem
 
+# Loaded before this module, they must be in the modules list
+__dependencies__ = ["welcome", "levels"]
+
 @discord.app_commands.guild_only()
 @discord.app_commands.default_permissions(manage_guild=True)
 class Bridges(commands.GroupCog):
@@ -20,37 +25,48 @@ class Bridges(commands.GroupCog):
         self.bot = bot
         self.welcome_cog: Welcome = None
         self.level_system_cog: LevelSystem = None
-        self.db_path = "db/bridges.db"
+        self.db = open_database("db/bridges.db")
+        # Read on every greeting, only changed by set-greeting-xp
+        self.greeting_xp_cache = GuildSettingsCache()
+        # Bounds the greetings processed at once, so a burst can't pile up database and API work
+        self.tasks = create_supervisor("bridges", max_concurrency=5, max_pending=200)
+        # Greeting XP of each member, summed and given every few seconds instead of once per greeting
+        self.exp_batcher: WriteBatcher[tuple[int, int], tuple[discord.Member, int]] = WriteBatcher(
+            self.write_greeting_exp,
+            interval=5.0,
+            max_size=100,
+            merge=lambda old, new: (new[0], old[1] + new[1])
+        )
         BotEvents.on_ready.register(self.on_ready)
-        self.bot.loop.create_task(self.init_db())
+
+    async def cog_load(self):
+        await self.init_db()
 
     async def init_db(self):
-        async with aiosqlite.connect(self.db_path) as db:
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS greeting_xp (
-                    guild_id INTEGER PRIMARY KEY,
-                    xp_gain INTEGER DEFAULT 35
-                )
-            """)
-            await db.commit()
+        await self.db.execute("""
+            CREATE TABLE IF NOT EXISTS greeting_xp (
+                guild_id INTEGER PRIMARY KEY,
+                xp_gain INTEGER DEFAULT 35
+            )
+        """)
 
     @discord.app_commands.command(name="set-greeting-xp", description="Set the XP gain per greeting for this server")
     @discord.app_commands.describe(xp="The amount of XP to award per greeting")
     async def set_greeting_xp(self, interaction: discord.Interaction, xp: int):
         """Set the XP gain per greeting for this guild."""
-        async with aiosqlite.connect(self.db_path) as db:
-            await db.execute(
-                "INSERT INTO greeting_xp (guild_id, xp_gain) VALUES (?, ?) ON CONFLICT(guild_id) DO UPDATE SET xp_gain = ?",
-                (interaction.guild.id, xp, xp)
-            )
-            await db.commit()
+        await self.db.execute(
+            "INSERT INTO greeting_xp (guild_id, xp_gain) VALUES (?, ?) ON CONFLICT(guild_id) DO UPDATE SET xp_gain = ?",
+            (interaction.guild.id, xp, xp)
+        )
+        self.greeting_xp_cache.invalidate(interaction.guild.id)
         await interaction.response.send_message(f"Greeting XP gain set to {xp} for this server.", ephemeral=True)
 
     async def get_greeting_xp(self, guild_id: int) -> int:
-        async with aiosqlite.connect(self.db_path) as db:
-            async with db.execute("SELECT xp_gain FROM greeting_xp WHERE guild_id = ?", (guild_id,)) as cursor:
-                row = await cursor.fetchone()
-                return row[0] if row else 0
+        return await self.greeting_xp_cache.get(guild_id, self.load_greeting_xp)
+
+    async def load_greeting_xp(self, guild_id: int) -> int:
+        row = await self.db.fetchone("SELECT xp_gain FROM greeting_xp WHERE guild_id = ?", (guild_id,))
+        return row[0] if row else 0
 
     def on_ready(self, bot: commands.Bot) -> None:
         BotEvents.on_ready.unregister(self.on_ready)
@@ -65,12 +81,16 @@ class Bridges(commands.GroupCog):
         self.welcome_cog.on_greeting.register(self.on_greeting)
 
     async def cog_unload(self):
+        BotEvents.on_ready.unregister(self.on_ready)
         if self.welcome_cog:
             self.welcome_cog.on_greeting.unregister(self.on_greeting)
+        await self.tasks.close()
+        await self.exp_batcher.close()
+        await self.db.close()
 
     def on_greeting(self, interaction: discord.Interaction, greeted_member: discord.Member) -> None:
-        log.info(f"Greeting event triggered for {interaction.user} greeting {greeted_member}")
-        asyncio.create_task(self.greeting_task(interaction, greeted_member))
+        log.info("Greeting event triggered for %s greeting %s", interaction.user, greeted_member, guild_id=interaction.guild_id)
+        self.tasks.spawn(self.greeting_task(interaction, greeted_member), name=f"greeting:{interaction.id}")
 
     async def greeting_task(self, interaction: discord.Interaction, greeted_member: discord.Member) -> None:
         log.info("Processing greeting...")
@@ -80,16 +100,29 @@ class Bridges(commands.GroupCog):
         xp_gain = await self.get_greeting_xp(interaction.guild.id)
         if xp_gain <= 0:
             return
-        old_level, new_level, exp_gain = await self.level_system_cog.update_user_exp(
-            interaction.user, xp_gain, LevelSystem.ExpGainType.WELCOME
-        )
-        log.info(f"{interaction.user} gained {exp_gain} experience points, old level: {old_level}, new level: {new_level}")
+        self.exp_batcher.add((interaction.guild_id, interaction.user.id), (interaction.user, xp_gain))
         await log.safe_followup(
             interaction,
             f"You greeted {greeted_member.mention}! You have been awarded {xp_gain} experience points.",
             ephemeral=True
         )
 
+    async def write_greeting_exp(self, batch: dict[tuple[int, int], tuple[discord.Member, int]]) -> None:
+        """Give the batched greeting XP, one update per member whatever the number of greetings"""
+        # The cog may have been removed since, it must not be used anymore
+        if not self.level_system_cog or self.bot.get_cog('LevelSystem') is not self.level_system_cog:
+            log.error("LevelSystem cog not available, %s greeting XP updates lost", len(batch))
+            return
+        for (guild_id, _), (member, xp) in batch.items():
+            try:
+                old_level, new_level, exp_gain = await self.level_system_cog.update_user_exp(
+                    member, xp, LevelSystem.ExpGainType.WELCOME
+                )
+                log.info("%s gained %s experience points, old level: %s, new level: %s", member, exp_gain, old_level, new_level, guild_id=guild_id)
+            except Exception as e:
+                # Not retried, the other members of the batch may already have been updated
+                log.error("Failed to give %s greeting experience points to %s: %s", xp, member, e, guild_id=guild_id)
+
 async def setup(bot: commands.Bot):
     log.info("Module `bridges` setup")
     await bot.add_cog(Bridges(bot))
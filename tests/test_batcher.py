@@ -0,0 +1,52 @@
+# Copyright (c) 2025 Benoît Pelletier
+# SPDX-License-Identifier: MPL-2.0
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+import asyncio
+import unittest
+from dismob.batcher import WriteBatcher
+
+class WriteBatcherTest(unittest.IsolatedAsyncioTestCase):
+    async def test_full_batch_during_flush_is_flushed(self):
+        batches = []
+        release = asyncio.Event()
+
+        async def flush(batch):
+            batches.append(dict(batch))
+            if len(batches) == 1:
+                await release.wait()
+
+        batcher = WriteBatcher(flush, interval=60.0, max_size=3)
+        for key in ("a", "b", "c"):
+            batcher.add(key, 1)
+        await asyncio.sleep(0)
+        self.assertEqual(batches, [{"a": 1, "b": 1, "c": 1}])
+
+        # Filled up while the first flush is still running
+        for key in ("d", "e", "f"):
+            batcher.add(key, 1)
+        release.set()
+        for _ in range(10):
+            await asyncio.sleep(0)
+
+        self.assertEqual(batches[1], {"d": 1, "e": 1, "f": 1})
+        self.assertEqual(len(batcher), 0)
+        await batcher.close()
+
+    async def test_values_are_merged_per_key(self):
+        batches = []
+
+        async def flush(batch):
+            batches.append(dict(batch))
+
+        batcher = WriteBatcher(flush, interval=60.0, max_size=10)
+        batcher.add("a", 1)
+        batcher.add("a", 2)
+        batcher.add("b", 5)
+        await batcher.close()
+        self.assertEqual(batches, [{"a": 3, "b": 5}])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,55 @@
+# Copyright (c) 2025 Benoît Pelletier
+# SPDX-License-Identifier: MPL-2.0
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+import logging
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+import discord
+from dismob import log
+
+class SafeSendMessageTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.logger = logging.getLogger("dismob.tests")
+        patcher = mock.patch.object(log, "logger", self.logger)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.channel = SimpleNamespace(name="general", id=42)
+
+    async def send_failing_with(self, exception: Exception):
+        limiter = SimpleNamespace(safe_send=mock.AsyncMock(side_effect=exception))
+        with mock.patch.object(log, "_rate_limiter", return_value=limiter), self.assertLogs(self.logger, logging.ERROR) as logs:
+            result = await log.safe_send_message(self.channel, "hello")
+        self.assertIsNone(result)
+        return logs.output
+
+    async def test_forbidden_returns_none(self):
+        response = SimpleNamespace(status=403, reason="Forbidden")
+        output = await self.send_failing_with(discord.Forbidden(response, "Missing Access"))
+        self.assertIn("permission to send messages in general", output[0])
+
+    async def test_other_error_returns_none(self):
+        output = await self.send_failing_with(OSError("connection reset"))
+        self.assertIn("Error when sending message: connection reset", output[0])
+
+class ErrorTest(unittest.TestCase):
+    def setUp(self):
+        self.logger = logging.getLogger("dismob.tests")
+        patcher = mock.patch.object(log, "logger", self.logger)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_positional_stacktrace_flag(self):
+        with self.assertWarns(DeprecationWarning), self.assertLogs(self.logger, logging.ERROR) as logs:
+            log.error("Something failed", True)
+        self.assertEqual(logs.records[0].getMessage(), "Something failed")
+        self.assertIsNotNone(logs.records[0].stack_info)
+
+    def test_bool_argument_is_formatted(self):
+        with self.assertLogs(self.logger, logging.ERROR) as logs:
+            log.error("Flag is %s", True)
+        self.assertEqual(logs.records[0].getMessage(), "Flag is True")
+        self.assertIsNone(logs.records[0].stack_info)